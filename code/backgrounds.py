@@ -0,0 +1,249 @@
+import os
+import re
+import json
+import bisect
+import logging
+import subprocess
+from typing import List, Tuple
+
+# locks.py
+from locks import locked, temp_filename
+
+logger = logging.getLogger(__name__)
+
+# Frame difference above which ffmpeg's scene score counts as a cut
+SCENE_THRESHOLD = 0.3
+# Seconds around a scene cut a render should not start in
+CUT_MARGIN = 1.0
+# Black frames detection: minimum duration in seconds and pixel threshold
+BLACK_MIN_DURATION = 0.5
+BLACK_PIXEL_THRESHOLD = 0.10
+# Golden ratio conjugate, steps the picker cursor evenly over the file
+GOLDEN_STEP = 0.6180339887498949
+# Maximum number of candidates the picker probes before giving up
+MAX_PROBES = 32
+
+INDEX_VERSION = 1
+
+# Indexes already read by this process, by index file
+INDEXES = {}
+
+SCENE_RE = re.compile(r"pts_time:\s*([0-9.]+)")
+BLACK_RE = re.compile(r"black_start:\s*([0-9.]+)\s+black_end:\s*([0-9.]+)")
+
+
+def index_filename(background: str) -> str:
+    """The index is a hidden file next to the background it describes."""
+    folder, name = os.path.split(os.path.abspath(background))
+    return os.path.join(folder, f".{name}.index.json")
+
+
+def cursor_filename(background: str) -> str:
+    """The pick counter lives apart from the index, which stays read-only once built."""
+    folder, name = os.path.split(os.path.abspath(background))
+    return os.path.join(folder, f".{name}.cursor")
+
+
+def next_pick(background: str) -> int:
+    """Return how many offsets were picked in a background before, and count this pick. The counter is shared by every worker under a lock."""
+    filename = cursor_filename(background)
+    with locked(filename):
+        picks = 0
+        if os.path.isfile(filename):
+            with open(filename, encoding='ascii') as file:
+                picks = int(file.read().strip() or 0)
+        with open(filename, 'w', encoding='ascii') as file:
+            file.write(str(picks + 1))
+    return picks
+
+
+def probe_keyframes(background: str) -> List[float]:
+    # Keyframe flags are read from the packets, nothing is decoded
+    output = subprocess.check_output(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags",
+         "-of", "csv=p=0", background], text=True)
+    keyframes = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if flags.startswith('K') and pts_time not in ('', 'N/A'):
+            keyframes.append(float(pts_time))
+    return sorted(keyframes)
+
+
+def probe_scenes(background: str) -> Tuple[List[float], List[Tuple[float, float]]]:
+    """Return the scene cut times and black intervals of a background in a single decoding pass."""
+    vf = (f"scale=160:-2,blackdetect=d={BLACK_MIN_DURATION}:pix_th={BLACK_PIXEL_THRESHOLD},"
+          f"select='gt(scene,{SCENE_THRESHOLD})',showinfo")
+    process = subprocess.run(["ffmpeg", "-hide_banner", "-nostats", "-i", background, "-an", "-vf", vf, "-f", "null", "-"],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    cuts, blacks = [], []
+    for line in process.stderr.splitlines():
+        if 'Parsed_showinfo' in line:
+            match = SCENE_RE.search(line)
+            if match:
+                cuts.append(float(match.group(1)))
+        elif 'black_start' in line:
+            match = BLACK_RE.search(line)
+            if match:
+                blacks.append((float(match.group(1)), float(match.group(2))))
+    return cuts, blacks
+
+
+def merge_intervals(intervals: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def build_index(background: str, duration: float) -> dict:
+    """
+    Build_index is a function that takes in a background video and its duration, runs ffmpeg scene and black frame detection once, and returns the start offsets a render can use.
+
+    A start is a keyframe that is neither inside a black interval nor within CUT_MARGIN seconds of a scene cut. Each start carries its runway, the seconds until the next black interval, so the picker can tell in constant time whether a job of a given length fits. A bucket table maps every whole second to the first start at or after it.
+
+    Args:
+        background (str): A string representing the path of the background video.
+        duration (float): The duration of the background in seconds.
+
+    Returns:
+        dict: The index, as persisted next to the background.
+
+    """
+    keyframes = probe_keyframes(background)
+    cuts, blacks = probe_scenes(background)
+    bad = merge_intervals(blacks + [(cut - CUT_MARGIN, cut + CUT_MARGIN) for cut in cuts])
+    bad_starts = [start for start, _ in bad]
+    black_starts = [start for start, _ in blacks]
+
+    starts, runways = [], []
+    for keyframe in keyframes:
+        position = bisect.bisect_right(bad_starts, keyframe) - 1
+        if position >= 0 and keyframe <= bad[position][1]:
+            continue
+        next_black = bisect.bisect_right(black_starts, keyframe)
+        runway = (black_starts[next_black] if next_black < len(black_starts) else duration) - keyframe
+        starts.append(keyframe)
+        runways.append(runway)
+
+    buckets = [bisect.bisect_left(starts, second) for second in range(int(duration) + 1)]
+
+    stat = os.stat(background)
+    return {
+        'version': INDEX_VERSION,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'duration': duration,
+        'starts': starts,
+        'runways': runways,
+        'buckets': buckets,
+        'cuts': cuts,
+        'blacks': blacks,
+    }
+
+
+def _read_index(filename: str, stat: os.stat_result):
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, encoding='utf-8') as file:
+        index = json.load(file)
+    if index.get('version') == INDEX_VERSION and index.get('size') == stat.st_size and index.get('mtime') == stat.st_mtime:
+        return index
+    return None
+
+
+def load_index(background: str, duration: float) -> dict:
+    """
+    Load the index of a background, building it when missing or when the file changed.
+
+    An index is never modified once built, so every process parses it once and keeps it. Building happens under a lock, the workers waiting on it read the index the first one wrote.
+    """
+    filename = index_filename(background)
+    stat = os.stat(background)
+    cached = INDEXES.get(filename)
+    if cached is not None and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+        return cached
+
+    index = _read_index(filename, stat)
+    if index is None:
+        with locked(filename):
+            index = _read_index(filename, stat)
+            if index is None:
+                logger.info(f'Building background index for {background}')
+                index = build_index(background, duration)
+                save_index(background, index)
+    INDEXES[filename] = index
+    return index
+
+
+def save_index(background: str, index: dict):
+    filename = index_filename(background)
+    tmp_filename = temp_filename(filename)
+    with open(tmp_filename, 'w', encoding='utf-8') as file:
+        json.dump(index, file)
+    os.replace(tmp_filename, filename)
+
+
+def pick_offset(background: str, duration: float, audio_duration: float) -> float:
+    """
+    Pick_offset is a function that takes in a background video, its duration and the duration of the audio to be merged with, and returns a keyframe aligned start offset that avoids black frames and scene cuts.
+
+    A cursor advances by the golden ratio on every pick, so consecutive renders land far apart and usage spreads evenly over the whole file. It is derived from a pick counter kept in a small locked file next to the background, the index itself is read-only. The cursor is mapped to a start through the bucket table; at most MAX_PROBES neighbouring starts are checked for enough runway, so a pick is constant time once the index is loaded.
+
+    Args:
+        background (str): A string representing the path of the background video.
+        duration (float): The duration of the background in seconds.
+        audio_duration (float): The duration of the audio in seconds.
+
+    Returns:
+        float: The start offset in seconds, 0 when no suitable start exists.
+
+    """
+    index = load_index(background, duration)
+    starts, runways, buckets = index['starts'], index['runways'], index['buckets']
+    latest = duration - audio_duration
+    if not starts or latest <= 0:
+        return 0.0
+
+    cursor = (next_pick(background) * GOLDEN_STEP) % 1.0
+
+    first = buckets[min(int(cursor * latest), len(buckets) - 1)]
+    # Probe outwards around the cursor: first, first + 1, first - 1, first + 2, ...
+    for probe in range(min(MAX_PROBES, len(starts))):
+        position = (first + (probe + 1) // 2 * (1 if probe % 2 else -1)) % len(starts)
+        if starts[position] <= latest and runways[position] >= audio_duration:
+            return starts[position]
+
+    logger.warning(f'No clean start found in {background} for {audio_duration:.1f}s of audio')
+    return 0.0
+
+
+def metadata_filename(folder: str) -> str:
+    return os.path.join(folder, ".metadata.json")
+
+
+def load_metadata(folder: str, url: str) -> dict:
+    """Return what is known about the background downloaded from url, an empty dictionary before its first download."""
+    filename = metadata_filename(folder)
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename, encoding='utf-8') as file:
+        return json.load(file).get(url, {})
+
+
+def save_metadata(folder: str, url: str, metadata: dict):
+    """Remember the file, size and resolution of a downloaded background, so a job can be costed before it is claimed."""
+    filename = metadata_filename(folder)
+    with locked(filename):
+        known = {}
+        if os.path.isfile(filename):
+            with open(filename, encoding='utf-8') as file:
+                known = json.load(file)
+        known[url] = metadata
+        tmp_filename = temp_filename(filename)
+        with open(tmp_filename, 'w', encoding='utf-8') as file:
+            json.dump(known, file)
+        os.replace(tmp_filename, filename)
@@ -0,0 +1,230 @@
+import os
+import time
+import shutil
+import logging
+import statistics
+from typing import List, Optional, Tuple
+
+from journal import RESOURCES, Journal
+from supervisor import available_memory, model_memory
+
+try:
+    import resource
+except ImportError:
+    # Windows has no getrusage, only the CPU time of this process is measured
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 ** 2
+GB = 1024 ** 3
+
+# Characters of text the TTS voice speaks per second
+CHARS_PER_SECOND = 15
+# Background assumed for a URL that was never downloaded on this host
+DEFAULT_BACKGROUND = {'width': 1920, 'height': 1080, 'size': 500 * MB}
+
+# Memory of a render besides the model: Python, TTS, caption files
+BASE_MEMORY = 0.5 * GB
+# ffmpeg memory per pixel of the background frame (decoder pool, filters, encoder lookahead)
+MEMORY_PER_PIXEL = 200
+
+# CPU-seconds per second of audio to transcribe, by model size
+TRANSCRIBE_CPU = {
+    'tiny': 0.3,
+    'base': 0.6,
+    'small': 2,
+    'medium': 6,
+    'large': 12,
+}
+# CPU-seconds per second of output to crop, blur, subtitle and encode the 1080x1920 video
+ENCODE_CPU = 3
+# CPU-seconds per second of output to decode a megapixel of background
+DECODE_CPU_PER_MEGAPIXEL = 0.2
+
+# Scratch bytes per second of output: mp3, captions and the encoded mp4
+OUTPUT_BYTES_PER_SECOND = 1 * MB
+
+# Headroom always left to the rest of the host
+RESERVE_MEMORY = 0.5 * GB
+RESERVE_DISK = 1 * GB
+# A job is admitted only if the idle cores finish it within this many seconds
+MAX_JOB_SECONDS = int(os.getenv('WORKER_MAX_JOB_SECONDS', '3600'))
+
+# Finished jobs the correction factors are learned from, and how far they may move the estimate
+HISTORY = 50
+MIN_SAMPLES = 5
+MIN_CORRECTION, MAX_CORRECTION = 0.25, 4.0
+
+
+def job_features(text: str, model: str, background: dict, model_loaded: bool) -> dict:
+    """
+    Job_features is a function that takes in what is known about a job before it is claimed, and returns the features its cost is estimated from.
+
+    Args:
+        text (str): The full text to be spoken.
+        model (str): The Whisper model name.
+        background (dict): The cached metadata of the background, an empty dictionary when it was never downloaded.
+        model_loaded (bool): Whether the model is already resident, in this process or in a shared one.
+
+    Returns:
+        dict: The audio duration in seconds, the model, the background resolution and the bytes still to download.
+
+    """
+    known = bool(background) and os.path.isfile(background.get('filename', ''))
+    background = {**DEFAULT_BACKGROUND, **background}
+    return {
+        'audio_seconds': len(text) / CHARS_PER_SECOND,
+        'model': model,
+        'model_loaded': model_loaded,
+        'pixels': background['width'] * background['height'],
+        'download': 0 if known else background['size'],
+    }
+
+
+def corrections(journal: Journal) -> dict:
+    """Learn one factor per resource from the median ratio of actual to estimated usage of the latest jobs."""
+    factors = {}
+    for name in RESOURCES:
+        ratios = journal.usage_ratios(name, HISTORY)
+        if len(ratios) < MIN_SAMPLES:
+            factors[name] = 1.0
+        else:
+            factors[name] = min(max(statistics.median(ratios), MIN_CORRECTION), MAX_CORRECTION)
+    return factors
+
+
+def estimate(features: dict, factors: Optional[dict] = None) -> dict:
+    """
+    Estimate is a function that takes in the features of a job and the learned correction factors, and returns the memory in bytes, CPU-seconds and scratch disk in bytes the job is expected to use.
+
+    Args:
+        features (dict): The features returned by job_features.
+        factors (dict): Correction factors per resource. Default value is no correction.
+
+    Returns:
+        dict: The estimated memory, cpu_seconds and disk.
+
+    """
+    factors = factors or {}
+    seconds = features['audio_seconds']
+    megapixels = features['pixels'] / 1e6
+    model_size = features['model'].split('.')[0]
+
+    memory = BASE_MEMORY + features['pixels'] * MEMORY_PER_PIXEL
+    if not features['model_loaded']:
+        memory += model_memory(features['model'])
+    cpu_seconds = seconds * (TRANSCRIBE_CPU.get(model_size, TRANSCRIBE_CPU['large'])
+                             + ENCODE_CPU + DECODE_CPU_PER_MEGAPIXEL * megapixels)
+    disk = seconds * OUTPUT_BYTES_PER_SECOND + features['download']
+
+    raw = {'memory': memory, 'cpu_seconds': cpu_seconds, 'disk': disk}
+    return {name: raw[name] * factors.get(name, 1.0) for name in RESOURCES}
+
+
+def headroom(path: str, reserved: Optional[dict] = None) -> dict:
+    """
+    Headroom is a function that returns the memory, idle cores and free disk under path the host can give to one more job.
+
+    The jobs already admitted have not necessarily allocated their memory or written their files yet, so their estimates are taken off what is measured. A running job is counted in full even once part of its usage shows in the measurements, which errs on the side of refusing.
+
+    Args:
+        path (str): A directory on the scratch disk.
+        reserved (dict): The summed estimates of the jobs in flight, as returned by Journal.reserved. Default value is none.
+
+    Returns:
+        dict: The memory and disk in bytes and the idle cores, None for what cannot be measured.
+
+    """
+    reserved = reserved or {}
+    memory = available_memory()
+    try:
+        idle_cores = (os.cpu_count() or 1) - os.getloadavg()[0]
+        # A job reserves its CPU-seconds spread over the longest time a job may take
+        idle_cores -= reserved.get('cpu_seconds', 0) / MAX_JOB_SECONDS
+    except (OSError, AttributeError):
+        idle_cores = None
+    return {
+        'memory': memory - RESERVE_MEMORY - reserved.get('memory', 0) if memory is not None else None,
+        'cores': idle_cores,
+        'disk': shutil.disk_usage(path).free - RESERVE_DISK - reserved.get('disk', 0),
+    }
+
+
+def admit(needed: dict, free: dict) -> Tuple[bool, List[str]]:
+    """
+    Admit is a function that takes in the estimate of a job and the host's headroom, and returns whether the job fits along with the resources it would overrun. A resource that cannot be measured never refuses a job.
+
+    Args:
+        needed (dict): The estimate returned by estimate.
+        free (dict): The headroom returned by headroom.
+
+    Returns:
+        Tuple[bool, List[str]]: Whether the job fits, and a description of every missing resource.
+
+    """
+    missing = []
+    if free['memory'] is not None and needed['memory'] > free['memory']:
+        missing.append(f"memory {needed['memory'] / GB:.1f}/{max(free['memory'], 0) / GB:.1f} GB")
+    if free['disk'] is not None and needed['disk'] > free['disk']:
+        missing.append(f"disk {needed['disk'] / GB:.1f}/{max(free['disk'], 0) / GB:.1f} GB")
+    if free['cores'] is not None and needed['cpu_seconds'] > max(free['cores'], 0) * MAX_JOB_SECONDS:
+        missing.append(f"cpu {needed['cpu_seconds']:.0f}s on {max(free['cores'], 0):.1f} idle cores")
+    return not missing, missing
+
+
+def _peak_rss() -> Optional[int]:
+    # VmHWM is the peak resident set of this process since the last reset
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _current_rss() -> int:
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def _cpu_seconds() -> float:
+    if resource is None:
+        return time.process_time()
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return self_usage.ru_utime + self_usage.ru_stime + children.ru_utime + children.ru_stime
+
+
+class UsageMeter:
+    """
+    Measures the resources a job actually used, to be compared with its estimate.
+
+    Memory is the growth of this process's peak resident set during the job, plus the peak of the largest subprocess (ffmpeg) waited for so far; the latter is an upper bound once a process has run several jobs. CPU is the user and system time of the process and its subprocesses. Disk is the size of the job's files plus the background when it was downloaded.
+    """
+
+    def __init__(self):
+        try:
+            # Reset VmHWM so the peak is the one of this job
+            with open('/proc/self/clear_refs', 'w') as file:
+                file.write('5')
+        except OSError:
+            pass
+        self.start_rss = _current_rss()
+        self.start_cpu = _cpu_seconds()
+
+    def stop(self, artifacts: List[str], download: int = 0) -> dict:
+        peak = _peak_rss()
+        children_peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024 if resource is not None else 0
+        actual = {
+            'cpu_seconds': _cpu_seconds() - self.start_cpu,
+            'disk': sum(os.path.getsize(artifact) for artifact in artifacts if os.path.isfile(artifact)) + download,
+        }
+        if peak is not None:
+            actual['memory'] = max(peak - self.start_rss, 0) + children_peak
+        return actual
@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+
+# locks.py
+from locks import locked, temp_filename
+
+BUILD_FILE = ".build.json"
+
+
+def fingerprint(inputs: dict) -> str:
+    """
+    Fingerprint is a function that takes in a dictionary of inputs and returns a stable hash of its contents. Keys are sorted so the same inputs always give the same fingerprint.
+
+    Args:
+        inputs (dict): A dictionary of JSON serializable values the artifact was built from.
+
+    Returns:
+        str: A hex digest identifying the inputs.
+
+    """
+    payload = json.dumps(inputs, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class BuildState:
+    """
+    Make-like record of the inputs every artifact of a job was last built from.
+
+    The state lives in a `.build.json` file inside the job directory. Several processes may build artifacts of the same directory, so saving merges the artifacts recorded by this instance into the file as it is on disk, under a lock. An artifact is stale when it is missing on disk or when the fingerprint of its current inputs differs from the recorded one. Downstream artifacts include the fingerprint of their upstream artifact in their own inputs, so a rebuilt mp3 makes the captions, the styled subtitles and the final mp4 stale as well.
+    """
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, BUILD_FILE)
+        self.artifacts = self.read()
+        # Artifacts recorded by this instance, the others are owned by whoever wrote them
+        self.recorded = set()
+
+    def read(self) -> dict:
+        if not os.path.isfile(self.path):
+            return {}
+        with open(self.path, encoding='utf-8') as file:
+            return json.load(file)
+
+    def inputs(self, artifact: str) -> dict:
+        return self.artifacts.get(artifact, {}).get('inputs', {})
+
+    def is_stale(self, artifact: str, inputs: dict) -> bool:
+        if not os.path.isfile(artifact):
+            return True
+        return self.artifacts.get(artifact, {}).get('fingerprint') != fingerprint(inputs)
+
+    def record(self, artifact: str, inputs: dict) -> str:
+        digest = fingerprint(inputs)
+        self.artifacts[artifact] = {'fingerprint': digest, 'inputs': inputs}
+        self.recorded.add(artifact)
+        self.save()
+        return digest
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with locked(self.path):
+            artifacts = self.read()
+            artifacts.update({artifact: self.artifacts[artifact] for artifact in self.recorded})
+            tmp_path = temp_filename(self.path)
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(artifacts, file, indent=4, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        self.artifacts = artifacts
+
+
+def audio_inputs(text: str, voice: str) -> dict:
+    return {'text': text, 'voice': voice}
+
+
+def transcript_inputs(audio: dict, model: str, options: dict, backend: str = None) -> dict:
+    inputs = {'audio': fingerprint(audio), 'model': model, 'options': options}
+    # Quantized backends give slightly different words and timings than the stock model
+    if backend is not None:
+        inputs['backend'] = backend
+    return inputs
+
+
+def caption_inputs(audio: dict, model: str, grouping: dict, options: dict, backend: str = None) -> dict:
+    inputs = {'audio': fingerprint(audio), 'model': model, 'grouping': grouping, 'options': options}
+    if backend is not None:
+        inputs['backend'] = backend
+    return inputs
+
+
+def subtitle_inputs(captions: dict, style: dict) -> dict:
+    return {'captions': fingerprint(captions), 'style': style}
+
+
+def video_inputs(subtitles: dict, background: str, encoder: list, filters: list = None) -> dict:
+    inputs = {'subtitles': fingerprint(subtitles), 'background': background, 'encoder': encoder}
+    if filters is not None:
+        inputs['filters'] = filters
+    return inputs
@@ -0,0 +1,225 @@
+import time
+import argparse
+from typing import List
+
+import numpy as np
+
+from subtitles import Segment
+
+# SRT tags around the spoken word of a word level caption, as stable_whisper writes them
+HIGHLIGHT = ('<font color="#00ff00">', '</font>')
+
+
+class Captions:
+    """
+    Word timings stored as NumPy arrays, one entry per word, with caption lines marked by breaks.
+
+    `breaks[i]` is True when word i starts a caption line. Every grouping rule only moves breaks, so a pass over the whole transcript is a handful of array operations whatever its length. The split and merge methods change the captions in place and return them, so they chain like the stable_whisper ones.
+    """
+
+    def __init__(self, words: List[str], start: np.ndarray, end: np.ndarray, breaks: np.ndarray):
+        self.words = list(words)
+        self.start = np.asarray(start, dtype=np.float64)
+        self.end = np.asarray(end, dtype=np.float64)
+        self.breaks = np.asarray(breaks, dtype=bool)
+        if len(self.words):
+            self.breaks[0] = True
+        # Whisper words carry their leading space, stable_whisper counts it in the length of a line
+        self.length = np.char.str_len(np.array(self.words, dtype=str))
+
+    @classmethod
+    def from_segments(cls, segments: List[Segment]) -> 'Captions':
+        segments = [segment for segment in segments if segment]
+        if not segments:
+            return cls([], np.empty(0), np.empty(0), np.empty(0, dtype=bool))
+        words = [word for segment in segments for word in segment]
+        breaks = np.zeros(len(words), dtype=bool)
+        breaks[np.cumsum([0] + [len(segment) for segment in segments[:-1]])] = True
+        return cls([word for word, _, _ in words], [start for _, start, _ in words], [end for _, _, end in words], breaks)
+
+    def line_starts(self) -> np.ndarray:
+        return np.flatnonzero(self.breaks)
+
+    def line_lengths(self, starts: np.ndarray) -> np.ndarray:
+        """Characters of every line, the leading space of its first word included."""
+        cumulative = np.concatenate(([0], np.cumsum(self.length)))
+        ends = np.append(starts[1:], len(self.words))
+        return cumulative[ends] - cumulative[starts]
+
+    def split_by_gap(self, max_gap: float) -> 'Captions':
+        """Start a new line at every word that follows a silence longer than max_gap seconds."""
+        self.breaks[1:] |= self.start[1:] - self.end[:-1] > max_gap
+        return self
+
+    def split_by_length(self, max_chars: int) -> 'Captions':
+        """
+        Split every line longer than max_chars into the fewest parts of even length, breaking at the word closest to each even split point.
+
+        A part can still be too long when its words are, it is split again by the next pass; a single word is never split.
+        """
+        cumulative = np.concatenate(([0], np.cumsum(self.length)))
+        while True:
+            starts = self.line_starts()
+            ends = np.append(starts[1:], len(self.words))
+            lengths = self.line_lengths(starts)
+            over = np.flatnonzero((lengths > max_chars) & (ends - starts > 1))
+            if not len(over):
+                return self
+
+            # Split point k of n, for every long line at once
+            parts = np.ceil(lengths[over] / max_chars).astype(np.int64)
+            cuts = parts - 1
+            line = np.repeat(over, cuts)
+            k = np.arange(cuts.sum()) - np.repeat(np.cumsum(cuts) - cuts, cuts) + 1
+            base = cumulative[starts[line]]
+            targets = base + k * lengths[line] / np.repeat(parts, cuts)
+
+            # Break before the word whose start is nearest to the target
+            after = np.searchsorted(cumulative, targets)
+            before = after - 1
+            nearest = np.where(cumulative[after] - targets < targets - cumulative[before], after, before)
+            self.breaks[np.clip(nearest, starts[line] + 1, ends[line] - 1)] = True
+
+    def merge_by_gap(self, min_gap: float, max_words: int = None) -> 'Captions':
+        """
+        Merge every line into the next one when the silence between them is at most min_gap seconds unless, with max_words, both lines have more words than that.
+
+        Like stable_whisper's merge_by_gap, the lines are merged from the last one backwards and the next line is counted as already merged, so a long line only refuses a chain of short lines once that chain grew past max_words. The gaps are compared at once, only the long lines at a short gap are scanned one by one.
+        """
+        starts = self.line_starts()
+        if len(starts) < 2:
+            return self
+        joins = self.start[starts[1:]] - self.end[starts[1:] - 1] <= min_gap
+        if max_words is not None:
+            counts = np.diff(np.append(starts, len(self.words)))
+            current = counts.tolist()
+            for i in reversed(np.flatnonzero(joins).tolist()):
+                if current[i] > max_words and current[i + 1] > max_words:
+                    joins[i] = False
+                else:
+                    current[i] += current[i + 1]
+        self.breaks[starts[1:][joins]] = False
+        return self
+
+    def regroup(self, split_by_gap: float, split_by_length: int, merge_by_gap: float, merge_max_words: int = None) -> 'Captions':
+        """Apply the grouping of CAPTION_GROUPING, in the order srt_create always applied it."""
+        return self.split_by_gap(split_by_gap).split_by_length(split_by_length).merge_by_gap(merge_by_gap, max_words=merge_max_words)
+
+    def segments(self) -> List[Segment]:
+        bounds = np.append(self.line_starts(), len(self.words)).tolist()
+        start, end = self.start.tolist(), self.end.tolist()
+        return [[(self.words[i], start[i], end[i]) for i in range(first, last)] for first, last in zip(bounds, bounds[1:])]
+
+    def to_srt(self, filename: str, word_level: bool = True) -> str:
+        """
+        To_srt is a function that writes the captions to an SRT file. With word_level every word gets its own entry showing the whole line with that word highlighted, like stable_whisper's word level output; otherwise every line is one entry.
+
+        Args:
+            filename (str): A string representing the path of the .srt file.
+            word_level (bool): Whether to write one entry per word. Default value is True.
+
+        Returns:
+            str: The filename.
+
+        """
+        entries = []
+        for segment in self.segments():
+            words = [word for word, _, _ in segment]
+            if not word_level:
+                entries.append((segment[0][1], segment[-1][2], ''.join(words).strip()))
+                continue
+            for i, (word, start, end) in enumerate(segment):
+                highlighted = words[:i] + [word[:len(word) - len(word.lstrip())] + HIGHLIGHT[0] + word.lstrip() + HIGHLIGHT[1]] + words[i + 1:]
+                entries.append((start, end, ''.join(highlighted).strip()))
+
+        with open(filename, 'w', encoding='utf-8') as file:
+            for number, (start, end, text) in enumerate(entries, 1):
+                file.write(f"{number}\n{srt_time(start)} --> {srt_time(end)}\n{text}\n\n")
+        return filename
+
+
+def srt_time(seconds: float) -> str:
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+
+def regroup(segments: List[Segment], grouping: dict) -> Captions:
+    """Regroup word timings, from a transcription or a saved .words.json, with a CAPTION_GROUPING dictionary."""
+    return Captions.from_segments(segments).regroup(**grouping)
+
+
+def synthetic_segments(words: int, seed: int = 0) -> List[Segment]:
+    """Whisper-like word timings: short words, mostly tight gaps with pauses, in 30 second windows."""
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(1, 10, words)
+    durations = 0.05 + lengths * 0.04
+    gaps = np.where(rng.random(words) < 0.1, rng.uniform(0.2, 1.0, words), rng.uniform(0.0, 0.1, words))
+    starts = np.cumsum(gaps + np.concatenate(([0], durations[:-1])))
+    ends = starts + durations
+    text = [' ' + 'w' * length for length in lengths.tolist()]
+    window = (starts // 30).astype(np.int64)
+    bounds = np.flatnonzero(np.diff(window)) + 1
+    return [[(text[i], float(starts[i]), float(ends[i])) for i in range(first, last)]
+            for first, last in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [words])))]
+
+
+def whisper_result_data(segments: List[Segment]) -> dict:
+    """The dictionary stable_whisper.WhisperResult is built from, for the same word timings."""
+    return {'segments': [{'start': segment[0][1], 'end': segment[-1][2], 'text': ''.join(word for word, _, _ in segment),
+                          'words': [{'word': word, 'start': start, 'end': end, 'probability': 1.0} for word, start, end in segment]}
+                         for segment in segments]}
+
+
+def benchmark(words: int = 10000, repeat: int = 5, grouping: dict = None) -> dict:
+    """
+    Benchmark is a function that regroups `words` synthetic word timings with the vectorized engine and, when stable_whisper is installed, with WhisperResult's own split and merge methods, and returns the best time of each in milliseconds.
+
+    Args:
+        words (int): The number of words.
+        repeat (int): Runs per engine, the fastest one counts.
+        grouping (dict): The grouping to apply. Default value is the one of main.py and worker.py.
+
+    Returns:
+        dict: Milliseconds per engine, and the number of lines each produced.
+
+    """
+    grouping = grouping or {'split_by_gap': 0.5, 'split_by_length': 38, 'merge_by_gap': 0.15, 'merge_max_words': 2}
+    segments = synthetic_segments(words)
+
+    results = {}
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        captions = regroup(segments, grouping)
+        best = min(best, time.perf_counter() - started)
+    results['numpy'] = {'ms': best * 1000, 'lines': len(captions.line_starts())}
+
+    try:
+        import stable_whisper
+    except ImportError:
+        return results
+
+    data = whisper_result_data(segments)
+    best = float('inf')
+    for _ in range(repeat):
+        result = stable_whisper.WhisperResult(data)
+        started = time.perf_counter()
+        result.split_by_gap(grouping['split_by_gap']).split_by_length(grouping['split_by_length']).merge_by_gap(
+            grouping['merge_by_gap'], max_words=grouping['merge_max_words'])
+        best = min(best, time.perf_counter() - started)
+    results['stable_whisper'] = {'ms': best * 1000, 'lines': len(result.segments)}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the caption regrouping of the vectorized engine against stable_whisper")
+    parser.add_argument("--words", default=10000, help="Number of synthetic words", type=int)
+    parser.add_argument("--repeat", default=5, help="Runs per engine", type=int)
+    args = parser.parse_args()
+
+    for name, result in benchmark(args.words, args.repeat).items():
+        print(f"{name:>15}: {result['ms']:.2f} ms, {result['lines']} lines")
@@ -0,0 +1,224 @@
+import os
+import re
+import json
+import shutil
+import logging
+import subprocess
+from typing import List, Set
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = os.getenv('FFMPEG', 'ffmpeg')
+# Capabilities of the local ffmpeg, probed once per binary
+CAPABILITIES_PATH = os.getenv('FFMPEG_CAPABILITIES', f"{os.getcwd()}{os.sep}.ffmpeg_capabilities.json")
+CAPABILITIES_VERSION = 1
+
+# Render node of the iGPU used by the VAAPI encoders
+VAAPI_DEVICE = os.getenv('VAAPI_DEVICE', '/dev/dri/renderD128')
+
+# Hardware encoders tried before a software encoder, fastest first, with the hwaccel they need
+HARDWARE_ENCODERS = {
+    'libx264': [('h264_qsv', 'qsv'), ('h264_vaapi', 'vaapi')],
+    'libx265': [('hevc_qsv', 'qsv'), ('hevc_vaapi', 'vaapi')],
+}
+# Software encoders tried when the profile's encoder is missing from a minimal build
+SOFTWARE_FALLBACK = {
+    'libx265': ['libx264', 'libopenh264', 'mpeg4'],
+    'libx264': ['libopenh264', 'mpeg4'],
+}
+# Options only the x264/x265 encoders understand, dropped on every other encoder
+SOFTWARE_OPTIONS = {'-crf', '-preset', '-tune', '-profile:v', '-x264-params', '-x265-params'}
+# Bitrate of a fallback encoder when the profile only sets a CRF
+FALLBACK_BITRATE = '5M'
+
+# Background blur, the first filter the build has is used
+BLUR_FILTERS = ['gblur=sigma=2', 'avgblur=sizeX=3', 'boxblur=luma_radius=2:luma_power=1']
+# Subtitle burn-in filters, both need libass
+SUBTITLE_FILTERS = ['ass', 'subtitles']
+
+ENCODER_RE = re.compile(r"^\s*[VAS][F.][S.][X.][B.][D.]\s+(\S+)", re.MULTILINE)
+FILTER_RE = re.compile(r"^\s*[T.][S.][C.]?\s+(\S+)\s+\S*->\S*", re.MULTILINE)
+
+CAPABILITIES = {}
+
+
+def parse_encoders(output: str) -> Set[str]:
+    """Return the encoder names listed by `ffmpeg -encoders`."""
+    # The legend above the dashes uses the same layout as the entries
+    return set(ENCODER_RE.findall(output.split('------', 1)[-1]))
+
+
+def parse_filters(output: str) -> Set[str]:
+    """Return the filter names listed by `ffmpeg -filters`."""
+    return set(FILTER_RE.findall(output))
+
+
+def parse_hwaccels(output: str) -> List[str]:
+    """Return the hardware acceleration methods listed by `ffmpeg -hwaccels`."""
+    lines = output.split(':', 1)[-1].splitlines()
+    return [line.strip() for line in lines if line.strip()]
+
+
+def run_ffmpeg(*args) -> str:
+    return subprocess.run([FFMPEG, '-hide_banner', *args], capture_output=True, text=True, timeout=30).stdout
+
+
+def hardware_setup(encoder: str) -> dict:
+    """Arguments and filters a hardware encoder needs around the software filter chain."""
+    if encoder.endswith('_vaapi'):
+        return {'input_args': ['-vaapi_device', VAAPI_DEVICE], 'upload': ',format=nv12,hwupload'}
+    if encoder.endswith('_qsv'):
+        return {'input_args': [], 'upload': ',format=nv12'}
+    return {'input_args': [], 'upload': ''}
+
+
+def test_encode(encoder: str) -> bool:
+    """Encode a few synthetic frames, a listed hardware encoder is useless without a working device."""
+    setup = hardware_setup(encoder)
+    args = [FFMPEG, '-hide_banner', '-v', 'error', *setup['input_args'],
+            '-f', 'lavfi', '-i', 'color=black:size=256x256:rate=30', '-frames:v', '5',
+            '-vf', 'null' + setup['upload'], '-c:v', encoder, '-f', 'null', '-']
+    try:
+        return subprocess.run(args, capture_output=True, timeout=30).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def ffmpeg_identity() -> dict:
+    binary = shutil.which(FFMPEG) or FFMPEG
+    stat = os.stat(binary)
+    return {'path': binary, 'size': stat.st_size, 'mtime': stat.st_mtime, 'vaapi_device': os.path.exists(VAAPI_DEVICE)}
+
+
+def probe_capabilities() -> dict:
+    """
+    Probe_capabilities is a function that lists the encoders, filters and hwaccels of the local ffmpeg and test-encodes with every hardware encoder the render profiles could use.
+
+    Returns:
+        dict: The capabilities, with the hardware encoders that passed their test under 'usable'.
+
+    """
+    encoders = parse_encoders(run_ffmpeg('-encoders'))
+    filters = parse_filters(run_ffmpeg('-filters'))
+    hwaccels = parse_hwaccels(run_ffmpeg('-hwaccels'))
+
+    usable = []
+    for candidates in HARDWARE_ENCODERS.values():
+        for encoder, hwaccel in candidates:
+            if encoder in encoders and hwaccel in hwaccels and test_encode(encoder):
+                usable.append(encoder)
+
+    return {
+        'version': CAPABILITIES_VERSION,
+        'ffmpeg': ffmpeg_identity(),
+        'encoders': sorted(encoders),
+        'filters': sorted(filters),
+        'hwaccels': hwaccels,
+        'usable': usable,
+    }
+
+
+def ffmpeg_capabilities(refresh: bool = False) -> dict:
+    """Return the capabilities of the local ffmpeg, probed on first use and cached on disk until the binary changes."""
+    if CAPABILITIES and not refresh:
+        return CAPABILITIES
+
+    identity = ffmpeg_identity()
+    capabilities = None
+    if not refresh and os.path.isfile(CAPABILITIES_PATH):
+        with open(CAPABILITIES_PATH, encoding='utf-8') as file:
+            cached = json.load(file)
+        if cached.get('version') == CAPABILITIES_VERSION and cached.get('ffmpeg') == identity:
+            capabilities = cached
+
+    if capabilities is None:
+        logger.info(f"Probing the capabilities of {identity['path']}")
+        capabilities = probe_capabilities()
+        tmp_filename = CAPABILITIES_PATH + f'.{os.getpid()}.tmp'
+        with open(tmp_filename, 'w', encoding='utf-8') as file:
+            json.dump(capabilities, file)
+        os.replace(tmp_filename, CAPABILITIES_PATH)
+
+    CAPABILITIES.clear()
+    CAPABILITIES.update(capabilities)
+    return CAPABILITIES
+
+
+def convert_profile(profile: list, encoder: str) -> list:
+    """Translate the output arguments of a software profile to another encoder, keeping the audio and muxer options."""
+    converted, crf = [], None
+    options = iter(profile)
+    for option in options:
+        if option == '-c:v':
+            next(options)
+            converted += ['-c:v', encoder]
+        elif option == '-crf':
+            crf = next(options)
+        elif option in SOFTWARE_OPTIONS:
+            next(options)
+        else:
+            converted.append(option)
+
+    if encoder in ('libx264', 'libx265'):
+        return converted + (['-crf', crf] if crf is not None else [])
+    if '-b:v' not in converted:
+        if crf is not None and encoder.endswith('_qsv'):
+            converted += ['-global_quality', crf]
+        elif crf is not None and encoder.endswith('_vaapi'):
+            converted += ['-rc_mode', 'CQP', '-qp', crf]
+        else:
+            converted += ['-b:v', FALLBACK_BITRATE]
+    return converted
+
+
+def encode_path(profile: list, capabilities: dict = None) -> dict:
+    """
+    Encode_path is a function that takes in a software encoder profile and the capabilities of the local ffmpeg, and returns the fastest way to render it: a working hardware encoder of the same codec, else the profile's own encoder, else the first software fallback the build has, along with the blur and subtitle filters available.
+
+    Args:
+        profile (list): The ffmpeg output arguments of the profile, with a software -c:v.
+        capabilities (dict): The capabilities returned by ffmpeg_capabilities. Default value is the local ffmpeg's.
+
+    Returns:
+        dict: The encoder, the input and output arguments, the blur and subtitle filters, and the filters appended to upload frames to the encoder.
+
+    """
+    capabilities = capabilities or ffmpeg_capabilities()
+    software = profile[profile.index('-c:v') + 1]
+
+    encoder = next((name for name, _ in HARDWARE_ENCODERS.get(software, []) if name in capabilities['usable']), None)
+    if encoder is None:
+        for name in [software] + SOFTWARE_FALLBACK.get(software, []):
+            if name in capabilities['encoders']:
+                encoder = name
+                break
+        else:
+            raise RuntimeError(f"ffmpeg has no encoder for the {software} profile")
+
+    subtitles = next((name for name in SUBTITLE_FILTERS if name in capabilities['filters']), None)
+    if subtitles is None:
+        raise RuntimeError("ffmpeg was built without libass, captions cannot be burnt in")
+    blur = next((blur for blur in BLUR_FILTERS if blur.split('=')[0] in capabilities['filters']), None)
+
+    output_args = profile if encoder == software else convert_profile(profile, encoder)
+    return {
+        'encoder': encoder,
+        'output_args': output_args,
+        'blur': blur,
+        'subtitles': subtitles,
+        **hardware_setup(encoder),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Probe the local ffmpeg and show the render path of an encoder")
+    parser.add_argument("--refresh", action='store_true', help="Probe again instead of using the cached capabilities")
+    parser.add_argument("--encoder", default="libx264", help="Software encoder of the profile (Default: libx264)")
+    cli_args = parser.parse_args()
+
+    capabilities = ffmpeg_capabilities(refresh=cli_args.refresh)
+    print(f"hwaccels: {', '.join(capabilities['hwaccels']) or 'none'}")
+    print(f"usable hardware encoders: {', '.join(capabilities['usable']) or 'none'}")
+    print(json.dumps(encode_path(["-c:v", cli_args.encoder], capabilities), indent=2))
@@ -0,0 +1,217 @@
+import sys
+import json
+import logging
+from typing import Iterator, Tuple
+
+# utils.py
+from utils import console
+
+# msg.py
+import msg
+
+# build.py
+from build import fingerprint
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 16
+# Largest element of a JSON array buffered while waiting for its end
+MAX_RECORD_SIZE = 16 << 20
+
+# Field name -> accepted types of a video.json entry
+JOB_SCHEMA = {
+    'series': (str,),
+    'part': (str, int),
+    'outro': (str,),
+    'path': (str,),
+    'text': (str,),
+}
+
+OPTIONAL_FIELDS = {
+    'background': (str,),
+}
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """
+    Parse_shard is a function that takes in a `i/N` string as passed to --shard and returns the shard index and the shard count.
+
+    Args:
+        value (str): A string like "0/4".
+
+    Returns:
+        Tuple[int, int]: The shard index and the number of shards.
+
+    """
+    try:
+        index, count = (int(x) for x in value.split('/'))
+    except ValueError:
+        raise ValueError(f"invalid shard {value!r}, expected i/N")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"invalid shard {value!r}, expected 0 <= i < N")
+    return index, count
+
+
+def validate_job(job) -> dict:
+    """
+    Validate_job is a function that takes in a decoded record and checks it against JOB_SCHEMA. It raises ValueError describing the first problem found.
+
+    Args:
+        job: The decoded JSON value of one record.
+
+    Returns:
+        dict: The record itself when it is valid.
+
+    """
+    if not isinstance(job, dict):
+        raise ValueError(f"expected an object, got {type(job).__name__}")
+    for field, types in JOB_SCHEMA.items():
+        if field not in job:
+            raise ValueError(f"missing field {field!r}")
+        if not isinstance(job[field], types):
+            raise ValueError(f"field {field!r} has type {type(job[field]).__name__}")
+    for field, types in OPTIONAL_FIELDS.items():
+        if field in job and not isinstance(job[field], types):
+            raise ValueError(f"field {field!r} has type {type(job[field]).__name__}")
+    return job
+
+
+class MalformedRecord(ValueError):
+    """Yielded in place of a JSON Lines record that does not decode, so the records after it are still read."""
+
+
+def _decode_line(line: str):
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        return MalformedRecord(f"invalid JSON: {e}")
+
+
+def _iter_jsonl(file) -> Iterator:
+    for line in file:
+        line = line.strip()
+        if line:
+            yield _decode_line(line)
+
+
+def _incomplete(error: json.JSONDecodeError, buffer: str) -> bool:
+    # A chunk boundary only cuts a single token, and no JSON token spans a line
+    return '\n' not in buffer[error.pos:]
+
+
+def _iter_json_array(file, buffer: str) -> Iterator:
+    """Decode the elements of a top level JSON array one at a time."""
+    decoder = json.JSONDecoder()
+    index = buffer.index('[') + 1
+    eof = False
+    while True:
+        # Skip separators between elements
+        while index < len(buffer) and buffer[index] in ' \t\r\n,':
+            index += 1
+        if index < len(buffer) and buffer[index] == ']':
+            return
+        try:
+            if index == len(buffer):
+                raise json.JSONDecodeError('Expecting value', buffer, index)
+            value, index = decoder.raw_decode(buffer, index)
+        except json.JSONDecodeError as e:
+            if eof or not _incomplete(e, buffer):
+                raise ValueError(f"malformed JSON array element: {e}") from e
+            if len(buffer) - index > MAX_RECORD_SIZE:
+                raise ValueError(f"JSON array element larger than {MAX_RECORD_SIZE} bytes at offset {e.pos}") from e
+            chunk = file.read(CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[index:] + chunk
+            index = 0
+            continue
+        yield value
+
+
+def iter_records(file) -> Iterator:
+    """
+    Iter_records is a generator that takes in an open text file holding either a JSON array or JSON Lines and yields the decoded records lazily, so the whole batch never has to fit in memory.
+
+    A JSON Lines record that does not decode is yielded as a MalformedRecord. A broken element of a JSON array ends the array, which raises ValueError as soon as the element is known to be malformed.
+
+    Args:
+        file: A text file object, e.g. an opened video.json or sys.stdin.
+
+    Yields:
+        The decoded JSON value of every record.
+
+    """
+    buffer = ''
+    # Sniff the format from the first line, a read of a whole chunk would wait for a slow pipe to fill it
+    while not buffer.strip():
+        chunk = file.readline(CHUNK_SIZE)
+        if not chunk:
+            return
+        buffer += chunk
+    if buffer.lstrip().startswith('['):
+        yield from _iter_json_array(file, buffer)
+        return
+    # JSON Lines: put the already read chunk back in front of the file
+    head, _, rest = buffer.rpartition('\n')
+    lines = head.split('\n') if head else []
+    for line in lines:
+        if line.strip():
+            yield _decode_line(line)
+    rest += file.readline()
+    if rest.strip():
+        yield _decode_line(rest)
+    yield from _iter_jsonl(file)
+
+
+def iter_jobs(source: str = 'video.json', shard: Tuple[int, int] = (0, 1), dedup: bool = True) -> Iterator[dict]:
+    """
+    Iter_jobs is a generator that takes in a JSON or JSONL source and yields the valid jobs of the requested shard. Invalid and undecodable records are logged and skipped; a malformed JSON array is logged and ends the input.
+
+    A record belongs to shard i/N when the fingerprint of its content modulo N is i, so several machines can split the same input without coordination and identical entries always land on the same shard, where they are deduplicated.
+
+    Args:
+        source (str): A path to a .json/.jsonl file, or "-" for stdin.
+        shard (Tuple[int, int]): The shard index and the number of shards.
+        dedup (bool): Skip records identical to one already yielded.
+
+    Yields:
+        dict: The validated job.
+
+    """
+    index, count = shard
+    seen = set()
+    file = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    records = iter_records(file)
+    number = 0
+    try:
+        while True:
+            number += 1
+            try:
+                record = next(records)
+            except StopIteration:
+                return
+            except ValueError as e:
+                console.log(f"{msg.ERROR}Stopping at record {number} of {source}: {e}")
+                logger.error(f'Stopping at record {number} of {source}: {e}')
+                return
+
+            try:
+                if isinstance(record, MalformedRecord):
+                    raise record
+                job = validate_job(record)
+            except ValueError as e:
+                console.log(f"{msg.WARNING}Skipping record {number} of {source}: {e}")
+                logger.warning(f'Skipping record {number} of {source}: {e}')
+                continue
+
+            digest = fingerprint(job)
+            if int(digest[:16], 16) % count != index:
+                continue
+            if dedup:
+                if digest in seen:
+                    logger.info(f'Skipping duplicate record {number} of {source}')
+                    continue
+                seen.add(digest)
+            yield job
+    finally:
+        if file is not sys.stdin:
+            file.close()
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# Job states
+CLAIMED = 'claimed'
+DONE = 'done'
+FAILED = 'failed'
+RELEASED = 'released'
+
+# Times a claimed job is resumed after a crash before it is released
+MAX_ATTEMPTS = 3
+# Seconds a finished job stays in the journal
+RETENTION = 7 * 24 * 3600
+# Resources measured for every job
+RESOURCES = ('memory', 'cpu_seconds', 'disk')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    job TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    artifacts TEXT NOT NULL DEFAULT '[]',
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    artifact TEXT NOT NULL,
+    completed_at REAL NOT NULL,
+    PRIMARY KEY (job_id, stage)
+);
+CREATE TABLE IF NOT EXISTS usage (
+    job_id TEXT NOT NULL,
+    features TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    estimated REAL NOT NULL,
+    actual REAL NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reservations (
+    job_id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    memory REAL NOT NULL,
+    cpu_seconds REAL NOT NULL,
+    disk REAL NOT NULL,
+    reserved_at REAL NOT NULL
+);
+"""
+
+
+def _alive(pid: int) -> bool:
+    if os.name != 'posix':
+        # os.kill would terminate the process on Windows, assume it is alive
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Journal:
+    """
+    Write-ahead journal of the jobs claimed by a worker, kept in SQLite.
+
+    A job is written as claimed before any work starts and every completed stage is recorded with its artifact, so after a crash the worker knows which jobs it owned, what it had already produced and which files on disk are partial. Every process opens its own connection; WAL mode lets the children of a supervisor share the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=FULL')
+        self.connection.executescript(SCHEMA)
+
+    def claim(self, job: dict):
+        """Record a claimed job, or count one more attempt when it is resumed."""
+        self.connection.execute(
+            "INSERT INTO jobs (id, job, status, attempts, updated_at) VALUES (?, ?, ?, 1, ?) "
+            "ON CONFLICT(id) DO UPDATE SET status = excluded.status, attempts = attempts + 1, updated_at = excluded.updated_at",
+            (job['_id'], json.dumps(job), CLAIMED, time.time()))
+
+    def plan(self, job_id: str, artifacts: List[str]):
+        """Record every file the job is going to write, partial copies are found from here after a crash."""
+        self.connection.execute("UPDATE jobs SET artifacts = ?, updated_at = ? WHERE id = ?",
+                                (json.dumps(artifacts), time.time(), job_id))
+
+    def complete_stage(self, job_id: str, stage: str, artifact: str):
+        self.connection.execute("INSERT OR REPLACE INTO stages (job_id, stage, artifact, completed_at) VALUES (?, ?, ?, ?)",
+                                (job_id, stage, artifact, time.time()))
+
+    def stages(self, job_id: str) -> dict:
+        rows = self.connection.execute("SELECT stage, artifact FROM stages WHERE job_id = ?", (job_id,))
+        return dict(rows.fetchall())
+
+    def finish(self, job_id: str, status: str):
+        self.connection.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?", (status, time.time(), job_id))
+
+    def attempts(self, job_id: str) -> int:
+        row = self.connection.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else 0
+
+    def unfinished(self) -> List[dict]:
+        rows = self.connection.execute("SELECT job FROM jobs WHERE status = ? ORDER BY updated_at", (CLAIMED,))
+        return [json.loads(job) for job, in rows.fetchall()]
+
+    def partial_artifacts(self, job_id: str) -> List[str]:
+        """Planned files of a job that no completed stage vouches for."""
+        row = self.connection.execute("SELECT artifacts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        completed = set(self.stages(job_id).values())
+        return [artifact for artifact in json.loads(row[0]) if artifact not in completed] if row else []
+
+    def collect_garbage(self) -> List[str]:
+        """
+        Delete the files of failed and released jobs and forget them, then forget finished jobs and usage records older than RETENTION.
+
+        Files planned by another job still in the journal are kept, as the same series and part may have been claimed again.
+
+        Returns:
+            List[str]: The deleted files.
+
+        """
+        rows = self.connection.execute("SELECT id, artifacts, status FROM jobs").fetchall()
+        kept = set()
+        for job_id, artifacts, status in rows:
+            if status not in (FAILED, RELEASED):
+                kept.update(json.loads(artifacts))
+
+        deleted = []
+        for job_id, artifacts, status in rows:
+            if status not in (FAILED, RELEASED):
+                continue
+            for artifact in json.loads(artifacts):
+                if artifact not in kept and os.path.isfile(artifact):
+                    os.remove(artifact)
+                    deleted.append(artifact)
+            self.forget(job_id)
+
+        expired = time.time() - RETENTION
+        for job_id, in self.connection.execute("SELECT id FROM jobs WHERE status = ? AND updated_at < ?", (DONE, expired)).fetchall():
+            self.forget(job_id)
+        self.connection.execute("DELETE FROM usage WHERE recorded_at < ?", (expired,))
+        return deleted
+
+    def record_usage(self, job_id: str, features: dict, estimated: dict, actual: dict):
+        """Record the estimated and measured resources of a finished job. Usage rows outlive the job, the cost model learns from them."""
+        now = time.time()
+        self.connection.executemany(
+            "INSERT INTO usage (job_id, features, resource, estimated, actual, recorded_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(job_id, json.dumps(features), resource, estimated[resource], actual[resource], now)
+             for resource in RESOURCES if resource in actual])
+
+    def usage_ratios(self, resource: str, limit: int) -> List[float]:
+        """Actual over estimated usage of the latest jobs, newest first."""
+        rows = self.connection.execute(
+            "SELECT actual / estimated FROM usage WHERE resource = ? AND estimated > 0 AND actual > 0 ORDER BY recorded_at DESC LIMIT ?",
+            (resource, limit))
+        return [ratio for ratio, in rows.fetchall()]
+
+    @contextmanager
+    def transaction(self):
+        """Run the block in a write transaction, so a read and the write depending on it are not interleaved with another process's."""
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def reserve(self, job_id: str, estimated: dict):
+        """Record the estimate of a job this process is about to run, until it is released."""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO reservations (job_id, pid, memory, cpu_seconds, disk, reserved_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, os.getpid(), *(estimated[resource] for resource in RESOURCES), time.time()))
+
+    def release(self, job_id: str):
+        self.connection.execute("DELETE FROM reservations WHERE job_id = ?", (job_id,))
+
+    def reserved(self) -> dict:
+        """
+        Return the resources reserved by the jobs in flight on this host, summed per resource.
+
+        A process that died without releasing its jobs no longer holds anything, its reservations are dropped.
+        """
+        rows = self.connection.execute("SELECT job_id, pid, memory, cpu_seconds, disk FROM reservations").fetchall()
+        total = dict.fromkeys(RESOURCES, 0.0)
+        for job_id, pid, *amounts in rows:
+            if not _alive(pid):
+                self.release(job_id)
+                continue
+            for resource, amount in zip(RESOURCES, amounts):
+                total[resource] += amount
+        return total
+
+    def forget(self, job_id: str):
+        self.connection.execute("DELETE FROM stages WHERE job_id = ?", (job_id,))
+        self.connection.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def close(self):
+        self.connection.close()
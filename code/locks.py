@@ -0,0 +1,26 @@
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no flock, a single worker process per host is assumed there
+    fcntl = None
+
+
+@contextmanager
+def locked(path: str):
+    """Hold an exclusive advisory lock on `path + '.lock'` while the block runs, across processes."""
+    fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+def temp_filename(path: str) -> str:
+    """A temporary file next to path that no other process writes, to be renamed over path."""
+    return f"{path}.{os.getpid()}.tmp"
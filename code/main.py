@@ -2,7 +2,6 @@ import platform
 import os
 import random
 import re
-import json
 import sys
 import subprocess
 import asyncio
@@ -18,10 +17,6 @@ import torch
 # ENV
 from dotenv import load_dotenv, find_dotenv
 
-# OpenAI Whisper Model PyTorch
-# import whisper
-import stable_whisper as whisper
-
 # MicrosoftEdge TTS
 import edge_tts
 from edge_tts import VoicesManager
@@ -35,6 +30,27 @@ from utils import *
 # msg.py
 import msg
 
+# build.py
+from build import BuildState, audio_inputs, caption_inputs, subtitle_inputs, transcript_inputs, video_inputs
+
+# backgrounds.py
+from backgrounds import pick_offset
+
+# transcriber.py
+from transcriber import inference_backend, transcribe as transcribe_audio
+
+# encoders.py
+from encoders import encode_path
+
+# subtitles.py
+from subtitles import HOUSE_STYLE, ass_filter, load_words, save_words, segments_from_result, write_ass
+
+# captions.py
+from captions import regroup
+
+# jobs.py
+from jobs import iter_jobs, parse_shard
+
 HOME = os.getcwd()
 
 # Logging
@@ -55,10 +71,26 @@ with KeepDir() as keep_dir:
 
 
 ###########################
-#        VIDEO.JSON       #
+#      RENDER SETTINGS    #
 ###########################
 
-jsonData = json.load(open('video.json', encoding='utf-8'))
+# Options of the Whisper transcription, vad skips the silences of the TTS audio
+TRANSCRIBE_OPTIONS = {
+    'regroup': True,
+    'vad': True,
+}
+
+# Caption grouping applied on top of the Whisper word timestamps
+CAPTION_GROUPING = {
+    'split_by_gap': 0.5,
+    'split_by_length': 38,
+    'merge_by_gap': 0.15,
+    'merge_max_words': 2,
+}
+
+# FFMPEG output codecs
+ENCODER_PROFILE = ["-c:v", "libx265", "-preset", "5", "-b:v", "5M",
+                   "-c:a", "aac", "-ac", "1", "-b:a", "96K"]
 
 
 #######################
@@ -84,10 +116,27 @@ async def main() -> bool:
                         help="Gender of the random TTS voice", type=str)
     parser.add_argument(
         "--language", help="Language of the random TTS voice for example: en-US", type=str)
+    parser.add_argument("--input", default="video.json",
+                        help="JSON or JSONL file with the videos to create, - for stdin", type=str)
+    parser.add_argument("--shard", default="0/1", metavar='i/N',
+                        help="Only create the videos of shard i out of N", type=str)
+    parser.add_argument("--dry-run", action='store_true',
+                        help="Only report which artifacts would be rebuilt")
     parser.add_argument("-v", "--verbose", action='store_true',
                         help="Verbose")
     args = parser.parse_args()
 
+    try:
+        shard = parse_shard(args.shard)
+    except ValueError as e:
+        console.log(f"{msg.ERROR}{e}")
+        sys.exit(1)
+
+    # Fastest encoder and filters the local ffmpeg has, probed once and cached on disk
+    render_path = encode_path(ENCODER_PROFILE)
+    console.log(f"{msg.OK}Encoding with {render_path['encoder']}")
+    logger.info(f"Encoding with {render_path['encoder']}")
+
     if args.random_voice:
         args.tts = None
         if not args.gender or not args.language:
@@ -128,19 +177,18 @@ async def main() -> bool:
                 f"{msg.WARNING}PyTorch GPU not found, using CPU instead")
             logger.warning('PyTorch GPU not found')
 
-        download_video(url=args.url)
+        if not args.dry_run:
+            download_video(url=args.url)
 
         # OpenAI-Whisper Model
         model = args.model
         if args.model != "large" and not args.non_english:
             model = args.model + ".en"
-        whisper_model = whisper.load_model(model)
 
-        console.log(f"{msg.OK}OpenAI-Whisper model loaded")
-        logger.info('OpenAI-Whisper model loaded')
+        voice = args.tts or f"random:{args.gender}:{args.language}"
 
         # Text 2 Speech (Edge TTS API)
-        for video_id, video in enumerate(jsonData):
+        for video_id, video in enumerate(iter_jobs(args.input, shard=shard)):
             series = video['series']
             part = video['part']
             outro = video['outro']
@@ -149,40 +197,98 @@ async def main() -> bool:
 
             req_text, filename = create_full_text(
                 path, series, part, text, outro)
+            srt_filename = f"{filename[:-len('.mp3')]}.srt"
+            ass_filename = f"{filename[:-len('.mp3')]}.ass"
+            words_filename = f"{filename[:-len('.mp3')]}.words.json"
+            final_video = video_filename(srt_filename)
+
+            build = BuildState(os.path.dirname(filename))
+
+            # Keep the background of the previous render unless a new one is requested
+            background_mp4 = video.get('background') or build.inputs(
+                final_video).get('background')
+            if not background_mp4 or not os.path.isfile(os.path.join(HOME, 'background', background_mp4)):
+                background_mp4 = random_background()
+
+            mp3_inputs = audio_inputs(req_text, voice)
+            words_inputs = transcript_inputs(mp3_inputs, model, TRANSCRIBE_OPTIONS, inference_backend())
+            srt_inputs = caption_inputs(mp3_inputs, model, CAPTION_GROUPING, TRANSCRIBE_OPTIONS, inference_backend())
+            ass_inputs = subtitle_inputs(srt_inputs, HOUSE_STYLE)
+            mp4_inputs = video_inputs(
+                ass_inputs, background_mp4, render_path['output_args'], [render_path['blur'], render_path['subtitles']])
+
+            stale = {
+                filename: build.is_stale(filename, mp3_inputs),
+                words_filename: build.is_stale(words_filename, words_inputs),
+                srt_filename: build.is_stale(srt_filename, srt_inputs),
+                ass_filename: build.is_stale(ass_filename, ass_inputs),
+                final_video: build.is_stale(final_video, mp4_inputs),
+            }
+
+            if args.dry_run:
+                for artifact, rebuild in stale.items():
+                    console.log(
+                        f"{msg.WARNING if rebuild else msg.OK}{'rebuild' if rebuild else 'up to date'}: {artifact}")
+                continue
 
-            console.log(f"{msg.OK}Text converted successfully")
-            logger.info('Text converted successfully')
-
-            await tts(req_text, outfile=filename, voice=args.tts, random_voice=args.random_voice, args=args)
-
-            console.log(
-                f"{msg.OK}Text2Speech mp3 file generated successfully!")
-            logger.info('Text2Speech mp3 file generated successfully!')
-
-            # Whisper Model to create SRT file from Speech recording
-            srt_filename = srt_create(
-                whisper_model, path, series, part, text, filename)
+            if stale[filename]:
+                console.log(f"{msg.OK}Text converted successfully")
+                logger.info('Text converted successfully')
 
-            console.log(
-                f"{msg.OK}Transcription srt and ass file saved successfully!")
-            logger.info('Transcription srt and ass file saved successfully!')
+                await tts(req_text, outfile=filename, voice=args.tts, random_voice=args.random_voice, args=args)
+                build.record(filename, mp3_inputs)
 
-            # Background video with srt and duration
-            background_mp4 = random_background()
-            file_info = get_info(background_mp4, verbose=args.verbose)
+                console.log(
+                    f"{msg.OK}Text2Speech mp3 file generated successfully!")
+                logger.info('Text2Speech mp3 file generated successfully!')
+            else:
+                logger.info(f'Reusing up to date {filename}')
+
+            if stale[words_filename]:
+                # Whisper Model to create SRT file from Speech recording
+                srt_filename = srt_create(
+                    model, path, series, part, text, filename)
+                build.record(words_filename, words_inputs)
+                build.record(srt_filename, srt_inputs)
+                build.record(ass_filename, ass_inputs)
 
-            final_video = prepare_background(
-                background_mp4, filename_mp3=filename, filename_srt=srt_filename, duration=int(file_info.get('duration')), verbose=args.verbose)
+                console.log(
+                    f"{msg.OK}Transcription srt and ass file saved successfully!")
+                logger.info('Transcription srt and ass file saved successfully!')
+            elif stale[srt_filename] or stale[ass_filename]:
+                # Only the grouping or the style changed, regroup the saved word timings
+                captions = regroup(load_words(words_filename), CAPTION_GROUPING)
+                captions.to_srt(srt_filename, word_level=True)
+                write_ass(captions.segments(), ass_filename, style=HOUSE_STYLE)
+                build.record(srt_filename, srt_inputs)
+                build.record(ass_filename, ass_inputs)
+
+                console.log(f"{msg.OK}Subtitles regrouped successfully!")
+                logger.info('Subtitles regrouped successfully!')
+            else:
+                logger.info(f'Reusing up to date {srt_filename}')
+
+            if stale[final_video]:
+                # Background video with srt and duration
+                file_info = get_info(background_mp4, verbose=args.verbose)
+
+                final_video = prepare_background(
+                    background_mp4, filename_mp3=filename, filename_srt=srt_filename, duration=int(file_info.get('duration')), verbose=args.verbose)
+                build.record(final_video, mp4_inputs)
 
-            console.log(
-                f"{msg.OK}MP4 video saved successfully!\nPath: {final_video}")
-            logger.info(f'MP4 video saved successfully!\nPath: {final_video}')
+                console.log(
+                    f"{msg.OK}MP4 video saved successfully!\nPath: {final_video}")
+                logger.info(f'MP4 video saved successfully!\nPath: {final_video}')
+            else:
+                console.log(
+                    f"{msg.OK}MP4 video up to date\nPath: {final_video}")
+                logger.info(f'MP4 video up to date\nPath: {final_video}')
 
     console.log(f'{msg.DONE}')
     return True
 
 
-def download_video(url: str, folder: str = 'background'):
+def download_video(url: str, folder: str = f"{HOME}{os.sep}background"):
     if not os.path.isdir(folder):
         os.mkdir(folder)
     with KeepDir() as keep_dir:
@@ -198,7 +304,8 @@ def download_video(url: str, folder: str = 'background'):
 def random_background(folder_path: str = "background"):
     with KeepDir() as keep_dir:
         keep_dir.chdir(f"{HOME}{os.sep}{folder_path}")
-        files = os.listdir(".")
+        # Skip the hidden segment indexes stored next to the backgrounds
+        files = [file for file in os.listdir(".") if not file.startswith('.')]
         random_file = random.choice(files)
     return random_file
 
@@ -206,7 +313,7 @@ def random_background(folder_path: str = "background"):
 def get_info(filename: str, verbose: bool = False):
     try:
         with KeepDir() as keep_dir:
-            keep_dir.chdir("background")
+            keep_dir.chdir(f"{HOME}{os.sep}background")
             probe = ffmpeg.probe(filename)
             video_stream = next(
                 (stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
@@ -238,34 +345,39 @@ def get_info(filename: str, verbose: bool = False):
         sys.exit(1)
 
 
-def prepare_background(background_mp4, filename_mp3, filename_srt, duration: int, verbose: bool = False):
+def video_filename(filename_srt: str) -> str:
+    srt_filename = filename_srt.split('/')[-1]
+    return f"{HOME}{os.sep}output{os.sep}{srt_filename}.mp4"
+
+
+def prepare_background(background_mp4, filename_mp3, filename_srt, duration: int, verbose: bool = False, encoder: list = ENCODER_PROFILE):
     # Get length of MP3 file to be merged with
     audio_info = get_info(filename_mp3)
 
-    # Get starting time:
-    audio_duration = int(round(audio_info.get('duration'), 0))
-    # print(duration-audio_duration)
-    ss = random.randint(0, (duration-audio_duration))
+    with KeepDir() as keep_dir:
+        keep_dir.chdir(f"{HOME}{os.sep}background")
+        mp4_absolute_path = os.path.abspath(background_mp4)
+
+    # Get starting time: keyframe aligned, away from black frames and scene cuts
+    ss = pick_offset(mp4_absolute_path, duration, audio_info.get('duration'))
     audio_duration = convert_time(audio_info.get('duration'))
-    if ss < 0:
-        ss = 0
 
     srt_filename = filename_srt.split('/')[-1]
+    ass_filename = srt_filename.replace(".srt", ".ass")
     srt_path = "/".join(filename_srt.split('/')[:-1])
 
     create_directory(os.getcwd(), "output")
-    outfile = f"{os.getcwd()}{os.sep}output{os.sep}{srt_filename}.mp4"
-
-    with KeepDir() as keep_dir:
-        keep_dir.chdir("background")
-        mp4_absolute_path = os.path.abspath(background_mp4)
+    outfile = video_filename(filename_srt)
 
     if verbose:
         rich_print(
             f"{filename_srt = }\n{mp4_absolute_path = }\n{filename_mp3 = }\n", style='bold green')   #
         # 'Alignment=9,BorderStyle=3,Outline=5,Shadow=3,Fontsize=15,MarginL=5,MarginV=25,FontName=Lexend Bold,ShadowX=-7.1,ShadowY=7.1,ShadowColour=&HFF000000,Blur=141'Outline=5
-    args = ["ffmpeg", "-ss", str(ss), "-t", str(audio_duration), "-i", mp4_absolute_path, "-i", filename_mp3, "-map", "0:v", "-map", "1:a", "-filter:v",
-            f"crop=ih/16*9:ih, scale=w=1080:h=1920:flags=bicubic, gblur=sigma=2, subtitles={srt_filename}:force_style=',Alignment=8,BorderStyle=7,Outline=3,Shadow=5,Blur=15,Fontsize=15,MarginL=45,MarginR=55,FontName=Lexend Bold'", "-c:v", "libx265", "-preset", "5", "-b:v", "5M", "-c:a", "aac", "-ac", "1", "-b:a", "96K", f"{outfile}", "-y", "-threads", f"{multiprocessing.cpu_count()/2}"]
+    render_path = encode_path(encoder)
+    video_filters = ["crop=ih/16*9:ih", "scale=w=1080:h=1920:flags=bicubic", render_path['blur'],
+                     ass_filter(ass_filename, name=render_path['subtitles'])]
+    args = ["ffmpeg", *render_path['input_args'], "-ss", f"{ss:.3f}", "-t", str(audio_duration), "-i", mp4_absolute_path, "-i", filename_mp3, "-map", "0:v", "-map", "1:a", "-filter:v",
+            ", ".join(video_filter for video_filter in video_filters if video_filter) + render_path['upload'], *render_path['output_args'], f"{outfile}", "-y", "-threads", f"{multiprocessing.cpu_count()/2}"]
 
     if verbose:
         rich_print('[i] FFMPEG Command:\n'+' '.join(args)+'\n', style='yellow')
@@ -275,34 +387,43 @@ def prepare_background(background_mp4, filename_mp3, filename_srt, duration: int
         with subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE) as process:
             pass
 
+    # A failed or killed encode leaves a partial mp4 that must not be recorded as up to date
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args)
+
     return outfile
 
 
-def srt_create(model, path: str, series: str, part: int, text: str, filename: str) -> bool:
+def srt_create(model, path: str, series: str, part: int, text: str, filename: str, style: dict = HOUSE_STYLE) -> bool:
     """
-    Srt_create is a function that takes in five arguments: a model for speech-to-text conversion, a path to a directory, a series name, a part number, text content, and a filename for the audio file. The function uses the specified model to convert the audio file to text, and creates a .srt file with the transcribed text and timestamps.
+    Srt_create is a function that takes in five arguments: a model for speech-to-text conversion, a path to a directory, a series name, a part number, text content, and a filename for the audio file. The function uses the specified model to convert the audio file to text, and creates a .srt file with the transcribed text and timestamps, a .words.json file with the word timings before grouping and a karaoke .ass file with the given style embedded.
 
     Args:
-        model: A model object used for speech-to-text conversion.
+        model (str): The name of the Whisper model, served by the transcription server when one is running.
         path (str): A string representing the path to the directory where the .srt file will be created.
         series (str): A string representing the name of the series.
         part (int): An integer representing the part number of the series.
         text (str): A string representing the main content of the audio file.
         filename (str): A string representing the name of the audio file.
+        style (dict): The ASS style embedded in the .ass file. Default value is HOUSE_STYLE.
 
     Returns:
         bool: A boolean indicating whether the creation of the .srt file was successful or not.
 
     """
-    transcribe = model.transcribe(
-        filename, regroup=True, fp16=torch.cuda.is_available())
-    transcribe.split_by_gap(0.5).split_by_length(
-        38).merge_by_gap(0.15, max_words=2)
+    transcribe = transcribe_audio(model, filename, **TRANSCRIBE_OPTIONS)
+    if transcribe.vad_skipped:
+        console.log(f"{msg.OK}VAD skipped {transcribe.vad_skipped:.1%} of the audio")
+        logger.info(f'VAD skipped {transcribe.vad_skipped:.1%} of {filename}')
     series = series.replace(' ', '_')
     srtFilename = os.path.join(
         f"{path}{os.sep}{series}{os.sep}", f"{series}_{part}")
-    transcribe.to_srt_vtt(srtFilename+'.srt', word_level=True)
-    transcribe.to_ass(srtFilename+'.ass', word_level=True)
+    # The word timings are saved before grouping, so a new grouping does not need a new transcription
+    segments = segments_from_result(transcribe)
+    save_words(segments, srtFilename+'.words.json')
+    captions = regroup(segments, CAPTION_GROUPING)
+    captions.to_srt(srtFilename+'.srt', word_level=True)
+    write_ass(captions.segments(), srtFilename+'.ass', style=style)
     os.chdir(HOME)
     return srtFilename+".srt"
 
@@ -351,11 +472,10 @@ def create_directory(path: str, directory: str) -> bool:
     bool: Returns True if a new directory was created, False otherwise.
 
     """
-    current_dir = os.getcwd()
-    os.chdir(path)
-    if not os.path.isdir(directory):
-        os.mkdir(directory)
-        os.chdir(current_dir)
+    # The working directory is left as it was, later relative paths depend on it
+    target = os.path.join(path, directory)
+    if not os.path.isdir(target):
+        os.mkdir(target)
         return True
     return False
 
@@ -0,0 +1,173 @@
+import os
+import base64
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Where finished renders go: "local" keeps them in output/ for the API host, "s3" uploads them
+OUTPUT_SINK = os.getenv('OUTPUT_SINK', 'local')
+# What happens to the local copy once the upload is confirmed: "keep" or "delete"
+OUTPUT_RETENTION = os.getenv('OUTPUT_RETENTION', 'keep')
+
+# Size of every multipart part but the last, S3 requires at least 5 MiB
+PART_SIZE = 8 * 1024 * 1024
+# Seconds between two looks at the file ffmpeg is writing
+PUMP_INTERVAL = 1
+
+# Muxer flags for an MP4 written front to back, so it can be uploaded while ffmpeg is still encoding
+FRAGMENTED_MP4 = ["-movflags", "+frag_keyframe+empty_moov+default_base_moof"]
+
+
+class ChecksumError(Exception):
+    pass
+
+
+class LocalUpload:
+    """The render stays in output/, served by the API host under /renders."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+
+    def pump(self):
+        pass
+
+    def finish(self) -> str:
+        return '/renders/' + os.path.basename(self.filename)
+
+    def abort(self):
+        pass
+
+
+class LocalSink:
+    streaming = False
+
+    def open(self, filename: str) -> LocalUpload:
+        return LocalUpload(filename)
+
+
+class MultipartUpload:
+    """
+    Uploads a file to an S3 compatible object store in multipart chunks while it is still being written.
+
+    Every call to pump uploads the complete parts that have appeared on disk since the last call; finish uploads the remainder and completes the upload. Every part is sent with its MD5 and the returned ETags are checked, and the SHA-256 of the uploaded bytes must match the final local file, otherwise the file was rewritten behind the uploader and it is uploaded again in one go.
+    """
+
+    def __init__(self, sink: 'S3Sink', filename: str):
+        self.sink = sink
+        self.client = sink.client
+        self.filename = filename
+        self.key = sink.key(filename)
+        self.upload_id = self.client.create_multipart_upload(
+            Bucket=sink.bucket, Key=self.key, ContentType='video/mp4')['UploadId']
+        self.offset = 0
+        self.parts = []
+        self.md5s = []
+        self.sha256 = hashlib.sha256()
+
+    def upload_part(self, data: bytes):
+        md5 = hashlib.md5(data)
+        number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.sink.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=data,
+            ContentMD5=base64.b64encode(md5.digest()).decode('ascii'))
+        if response['ETag'].strip('"') != md5.hexdigest():
+            raise ChecksumError(f"part {number} of {self.key} was stored with ETag {response['ETag']}")
+        self.parts.append({'PartNumber': number, 'ETag': response['ETag']})
+        self.md5s.append(md5.digest())
+        self.sha256.update(data)
+        self.offset += len(data)
+
+    def pump(self, final: bool = False):
+        if not os.path.isfile(self.filename):
+            return
+        with open(self.filename, 'rb') as file:
+            file.seek(self.offset)
+            while True:
+                available = os.path.getsize(self.filename) - self.offset
+                if available >= PART_SIZE:
+                    self.upload_part(file.read(PART_SIZE))
+                elif final and (available > 0 or not self.parts):
+                    self.upload_part(file.read(available))
+                    return
+                else:
+                    return
+
+    def finish(self) -> str:
+        try:
+            self.pump(final=True)
+            response = self.client.complete_multipart_upload(
+                Bucket=self.sink.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={'Parts': self.parts})
+        except Exception:
+            self.abort()
+            raise
+
+        expected = f"{hashlib.md5(b''.join(self.md5s)).hexdigest()}-{len(self.parts)}"
+        if response['ETag'].strip('"') != expected:
+            raise ChecksumError(f"{self.key} was stored with ETag {response['ETag']}, expected {expected}")
+
+        if self.sha256.hexdigest() != file_sha256(self.filename):
+            logger.warning(f'{self.filename} changed while it was uploaded, uploading it again')
+            self.client.upload_file(self.filename, self.sink.bucket, self.key, ExtraArgs={'ContentType': 'video/mp4'})
+
+        self.sink.verify(self.filename, self.key)
+        return self.sink.url(self.key)
+
+    def abort(self):
+        self.client.abort_multipart_upload(Bucket=self.sink.bucket, Key=self.key, UploadId=self.upload_id)
+
+
+class S3Sink:
+    """
+    Output sink for an S3 compatible object store, e.g. MinIO through S3_ENDPOINT_URL.
+
+    Credentials come from the usual AWS environment variables. Once an upload is confirmed, the local copy is deleted when OUTPUT_RETENTION is "delete".
+    """
+    streaming = True
+
+    def __init__(self, bucket: str = None, prefix: str = None, endpoint_url: str = None, public_url: str = None, retention: str = OUTPUT_RETENTION):
+        try:
+            import boto3
+        except ImportError:
+            raise ImportError("The s3 output sink requires boto3: pip install boto3")
+        self.bucket = bucket or os.environ['S3_BUCKET']
+        self.prefix = prefix if prefix is not None else os.getenv('S3_PREFIX', 'renders/')
+        endpoint_url = endpoint_url or os.getenv('S3_ENDPOINT_URL')
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.public_url = (public_url or os.getenv('S3_PUBLIC_URL')
+                           or f"{endpoint_url or 'https://s3.amazonaws.com'}/{self.bucket}").rstrip('/')
+        self.retention = retention
+
+    def key(self, filename: str) -> str:
+        return self.prefix + os.path.basename(filename)
+
+    def url(self, key: str) -> str:
+        return f"{self.public_url}/{key}"
+
+    def open(self, filename: str) -> MultipartUpload:
+        return MultipartUpload(self, filename)
+
+    def verify(self, filename: str, key: str):
+        """Check the stored object against the local file, then apply the retention policy."""
+        head = self.client.head_object(Bucket=self.bucket, Key=key)
+        if head['ContentLength'] != os.path.getsize(filename):
+            raise ChecksumError(f"{key} has {head['ContentLength']} bytes, {filename} has {os.path.getsize(filename)}")
+        if self.retention == 'delete':
+            os.remove(filename)
+            logger.info(f'Deleted {filename}, uploaded as {key}')
+
+
+def file_sha256(filename: str) -> str:
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_sink(name: str = OUTPUT_SINK):
+    if name == 'local':
+        return LocalSink()
+    if name == 's3':
+        return S3Sink()
+    raise ValueError(f"unknown output sink {name!r}, expected local or s3")
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import argparse
+import subprocess
+from typing import List, Tuple
+
+# A caption line is a list of (word, start, end) tuples
+Segment = List[Tuple[str, float, float]]
+
+# Fonts handed to libass through the ass filter's fontsdir option, next to the scripts whatever the working directory
+FONTS_DIR = os.getenv('FONTS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts'))
+
+# The force_style previously passed to the subtitles filter, kept for the benchmark
+LEGACY_FORCE_STYLE = 'Alignment=8,BorderStyle=7,Outline=3,Shadow=5,Blur=15,Fontsize=15,MarginL=45,MarginR=55,FontName=Lexend Bold'
+
+# House style for a 1080x1920 canvas. The sizes are the legacy force_style
+# values scaled from libass' default 384x288 SRT canvas.
+HOUSE_STYLE = {
+    'PlayResX': 1080,
+    'PlayResY': 1920,
+    'Fontname': 'Lexend Bold',
+    'Fontsize': 100,
+    'PrimaryColour': '&H0000FFFF',  # Spoken words (yellow)
+    'SecondaryColour': '&H00FFFFFF',  # Upcoming words (white)
+    'OutlineColour': '&H00000000',
+    'BackColour': '&H80000000',
+    'Outline': 20,
+    'Shadow': 33,
+    'Blur': 100,
+    'Alignment': 8,
+    'MarginL': 127,
+    'MarginR': 155,
+    'MarginV': 67,
+}
+
+STYLE_FORMAT = ['Name', 'Fontname', 'Fontsize', 'PrimaryColour', 'SecondaryColour', 'OutlineColour', 'BackColour', 'Bold', 'Italic', 'Underline',
+                'StrikeOut', 'ScaleX', 'ScaleY', 'Spacing', 'Angle', 'BorderStyle', 'Outline', 'Shadow', 'Alignment', 'MarginL', 'MarginR', 'MarginV', 'Encoding']
+
+STYLE_DEFAULTS = {
+    'Name': 'Default',
+    'Bold': 0,
+    'Italic': 0,
+    'Underline': 0,
+    'StrikeOut': 0,
+    'ScaleX': 100,
+    'ScaleY': 100,
+    'Spacing': 0,
+    'Angle': 0,
+    'BorderStyle': 1,
+    'Encoding': 1,
+}
+
+
+def segments_from_result(result) -> List[Segment]:
+    """
+    Segments_from_result is a function that takes in a stable_whisper result and returns its word timings as plain tuples, grouped by caption line.
+
+    Args:
+        result: A WhisperResult after regrouping.
+
+    Returns:
+        List[Segment]: One list of (word, start, end) per caption line.
+
+    """
+    return [[(word.word, word.start, word.end) for word in segment.words] for segment in result.segments if segment.words]
+
+
+def save_words(segments: List[Segment], filename: str) -> str:
+    with open(filename, 'w', encoding='utf-8') as file:
+        json.dump(segments, file, ensure_ascii=False)
+    return filename
+
+
+def load_words(filename: str) -> List[Segment]:
+    with open(filename, encoding='utf-8') as file:
+        return [[tuple(word) for word in segment] for segment in json.load(file)]
+
+
+def ass_time(seconds: float) -> str:
+    centiseconds = int(round(seconds * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    seconds, centiseconds = divmod(centiseconds, 100)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+
+
+def ass_header(style: dict = HOUSE_STYLE) -> str:
+    """
+    Ass_header is a function that takes in a style dictionary and returns the [Script Info] and [V4+ Styles] sections of an ASS file with that style embedded, so libass does not have to apply a force_style to every job.
+
+    Args:
+        style (dict): The style fields, see HOUSE_STYLE.
+
+    Returns:
+        str: The ASS header up to and including the [Events] format line.
+
+    """
+    fields = {**STYLE_DEFAULTS, **style}
+    return (
+        "[Script Info]\n"
+        "ScriptType: v4.00+\n"
+        f"PlayResX: {fields['PlayResX']}\n"
+        f"PlayResY: {fields['PlayResY']}\n"
+        "WrapStyle: 0\n"
+        "ScaledBorderAndShadow: yes\n"
+        "\n"
+        "[V4+ Styles]\n"
+        f"Format: {', '.join(STYLE_FORMAT)}\n"
+        f"Style: {','.join(str(fields[name]) for name in STYLE_FORMAT)}\n"
+        "\n"
+        "[Events]\n"
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n"
+    )
+
+
+def ass_text(word: str) -> str:
+    # ASS has no escaping, keep override blocks and hard breaks out of the text
+    return word.replace('\\', '/').replace('{', '(').replace('}', ')').replace('\n', ' ')
+
+
+def karaoke_line(segment: Segment) -> str:
+    """
+    Karaoke_line is a function that takes in a caption line and returns its text with one \\k tag per word. Durations are computed from absolute centiseconds so rounding never drifts along the line; silences between words get an empty \\k.
+
+    Args:
+        segment (Segment): The (word, start, end) tuples of the line.
+
+    Returns:
+        str: The event text.
+
+    """
+    parts = []
+    cursor = int(round(segment[0][1] * 100))
+    for index, (word, start, end) in enumerate(segment):
+        start, end = int(round(start * 100)), int(round(end * 100))
+        if start > cursor:
+            parts.append(f"{{\\k{start - cursor}}}")
+            cursor = start
+        word = ass_text(word.lstrip() if index == 0 else word)
+        parts.append(f"{{\\k{max(end - cursor, 0)}}}{word}")
+        cursor = max(end, cursor)
+    return ''.join(parts)
+
+
+def write_ass(segments: List[Segment], filename: str, style: dict = HOUSE_STYLE) -> str:
+    """
+    Write_ass is a function that takes in caption lines and writes a compact ASS file: one event per line with karaoke tags for the word highlighting, instead of one overlapping event per word.
+
+    Args:
+        segments (List[Segment]): The caption lines.
+        filename (str): A string representing the path of the .ass file.
+        style (dict): The style embedded in the file.
+
+    Returns:
+        str: The filename of the ASS file.
+
+    """
+    fields = {**STYLE_DEFAULTS, **style}
+    blur = f"{{\\blur{fields['Blur']}}}" if fields.get('Blur') else ''
+    with open(filename, 'w', encoding='utf-8') as file:
+        file.write(ass_header(style))
+        for segment in segments:
+            if not segment:
+                continue
+            start, end = segment[0][1], segment[-1][2]
+            file.write(
+                f"Dialogue: 0,{ass_time(start)},{ass_time(end)},{fields['Name']},,0,0,0,,{blur}{karaoke_line(segment)}\n")
+    return filename
+
+
+def ass_filter(filename: str, fonts_dir: str = FONTS_DIR, name: str = 'ass') -> str:
+    # The subtitles filter renders .ass files the same way, for builds without the ass filter
+    if os.path.isdir(fonts_dir):
+        return f"{name}={filename}:fontsdir='{fonts_dir}'"
+    return f"{name}={filename}"
+
+
+def benchmark(background: str, srt_filename: str, ass_filename: str, seconds: float = 10) -> dict:
+    """
+    Benchmark is a function that takes in a background video and the SRT and ASS captions of the same job, renders `seconds` of video to the null muxer with each subtitle path and returns the subtitle filter cost per frame in milliseconds, net of the crop/scale/blur chain both paths share.
+
+    Args:
+        background (str): A string representing the path of the background video.
+        srt_filename (str): The word level SRT file.
+        ass_filename (str): The compact ASS file.
+        seconds (float): The length of video to render.
+
+    Returns:
+        dict: Milliseconds per frame for the `subtitles` and `ass` paths.
+
+    """
+    base = "crop=ih/16*9:ih,scale=1080:1920:flags=lanczos,gblur=sigma=2"
+    paths = {
+        'none': base,
+        'subtitles': f"{base},subtitles={srt_filename}:force_style='{LEGACY_FORCE_STYLE}'",
+        'ass': f"{base},{ass_filter(ass_filename)}",
+    }
+    frames = int(subprocess.check_output(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets", "-read_intervals", f"%+{seconds}",
+         "-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", background], text=True).strip())
+
+    elapsed = {}
+    for name, vf in paths.items():
+        start = time.perf_counter()
+        subprocess.run(["ffmpeg", "-v", "error", "-t", str(seconds), "-i", background, "-an", "-vf", vf, "-f", "null", "-"],
+                       check=True)
+        elapsed[name] = time.perf_counter() - start
+
+    return {name: (elapsed[name] - elapsed['none']) * 1000 / frames for name in ('subtitles', 'ass')}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the subtitle filter cost per frame of the SRT and ASS paths")
+    parser.add_argument("background", help="Background video", type=str)
+    parser.add_argument("srt", help="Word level SRT file", type=str)
+    parser.add_argument("ass", help="Compact ASS file", type=str)
+    parser.add_argument("--seconds", default=10, help="Seconds of video to render", type=float)
+    args = parser.parse_args()
+
+    for name, cost in benchmark(args.background, args.srt, args.ass, args.seconds).items():
+        print(f"{name:>10}: {cost:.3f} ms/frame")
@@ -0,0 +1,202 @@
+import os
+import time
+import logging
+import multiprocessing
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 ** 3
+
+# Approximate resident memory of a loaded Whisper model, in bytes
+MODEL_MEMORY = {
+    'tiny': 1 * GB,
+    'base': 1 * GB,
+    'small': 2 * GB,
+    'medium': 5 * GB,
+    'large': 10 * GB,
+}
+
+# Memory a child needs on top of the model (TTS, ffmpeg, buffers)
+RENDER_MEMORY = 1.5 * GB
+# Cores given to every child, for PyTorch and ffmpeg threads
+CORES_PER_WORKER = 2
+# Seconds between two supervisor ticks
+POLL_INTERVAL = 10
+# Seconds an idle child waits for work before polling again
+CHILD_POLL_INTERVAL = 10
+# Times a claimed job is handed to a new child after its child crashed
+MAX_RESTARTS = 2
+
+
+def available_memory() -> Optional[int]:
+    """Return the memory available for new processes in bytes, None when it cannot be measured."""
+    try:
+        with open('/proc/meminfo') as file:
+            for line in file:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def model_memory(model: str) -> int:
+    return MODEL_MEMORY.get(model.split('.')[0], MODEL_MEMORY['large'])
+
+
+def child_main(slot: int, job, claims, retire, pick_job: Callable, run_job: Callable, init_child: Optional[Callable]):
+    """
+    Child_main is the loop of a child worker. It claims jobs with pick_job and renders them with run_job, one at a time, until the supervisor sets its retire event.
+
+    The job being rendered is stored in the shared claims dictionary under the child's slot, so the supervisor can hand it to a replacement if the child dies.
+
+    Args:
+        slot (int): The slot of the child in the supervisor.
+        job: A job claimed by a previous child of this slot that crashed, or None.
+        claims: The shared slot -> job dictionary.
+        retire: An event set by the supervisor when this child should exit once idle.
+        pick_job (Callable): Claims and returns the next job, or None when the queue is empty.
+        run_job (Callable): Renders a job.
+        init_child (Callable): Called once in the child before the first job.
+
+    """
+    if init_child is not None:
+        init_child()
+    while not retire.is_set():
+        if job is None:
+            job = pick_job()
+        if job is None:
+            time.sleep(CHILD_POLL_INTERVAL)
+            continue
+        claims[slot] = job
+        run_job(job)
+        # A claim left behind by a crash is picked up by the supervisor
+        claims.pop(slot, None)
+        job = None
+
+
+class Supervisor:
+    """
+    Forks child workers on a single host and scales their number with the job queue and the machine's headroom.
+
+    Models loaded by the supervisor before it starts are shared by all children through copy-on-write when the fork start method is available; otherwise every child pays for its own copy and the memory budget accounts for it.
+    """
+
+    def __init__(self, pick_job: Callable, run_job: Callable, has_pending: Callable, fail_job: Callable, model: str = 'small', min_workers: int = 1, max_workers: Optional[int] = None, init_child: Optional[Callable] = None, on_tick: Optional[Callable] = None):
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self.shared_model = self.context.get_start_method() == 'fork'
+        self.pick_job = pick_job
+        self.run_job = run_job
+        self.has_pending = has_pending
+        self.fail_job = fail_job
+        self.model = model
+        self.min_workers = max(min_workers, 0)
+        self.max_workers = max_workers or self.cpu_limit()
+        self.init_child = init_child
+        # Called at the start of every tick, e.g. to keep a shared service alive
+        self.on_tick = on_tick
+
+        self.manager = self.context.Manager()
+        self.claims = self.manager.dict()
+        self.children = {}
+        self.restarts = {}
+
+    def cpu_limit(self) -> int:
+        return max((os.cpu_count() or 1) // CORES_PER_WORKER, 1)
+
+    def child_memory(self) -> int:
+        if self.shared_model:
+            return int(RENDER_MEMORY)
+        return int(RENDER_MEMORY + model_memory(self.model))
+
+    def capacity(self) -> int:
+        """Return how many children the host can run right now."""
+        alive = len(self.children)
+        free = available_memory()
+        by_memory = alive + free // self.child_memory() if free is not None else self.max_workers
+        return max(min(self.max_workers, self.cpu_limit(), by_memory), self.min_workers)
+
+    def spawn(self, slot: int, job=None):
+        retire = self.context.Event()
+        process = self.context.Process(
+            target=child_main, args=(slot, job, self.claims, retire, self.pick_job, self.run_job, self.init_child), daemon=False)
+        process.start()
+        self.children[slot] = (process, retire)
+        logger.info(f'Started child {slot} (pid {process.pid})' + (f' resuming job {job["_id"]}' if job else ''))
+
+    def free_slot(self) -> int:
+        slot = 0
+        while slot in self.children:
+            slot += 1
+        return slot
+
+    def reap(self):
+        """Restart crashed children with the job they had claimed."""
+        for slot, (process, retire) in list(self.children.items()):
+            if process.is_alive():
+                continue
+            del self.children[slot]
+            job = self.claims.pop(slot, None)
+            if job is None:
+                logger.info(f'Child {slot} exited')
+                continue
+
+            logger.warning(f'Child {slot} died with exit code {process.exitcode} while rendering job {job["_id"]}')
+            restarts = self.restarts.get(job['_id'], 0) + 1
+            self.restarts[job['_id']] = restarts
+            if restarts > MAX_RESTARTS:
+                logger.error(f'Giving up on job {job["_id"]} after {MAX_RESTARTS} restarts')
+                self.fail_job(job)
+                del self.restarts[job['_id']]
+                continue
+            self.spawn(slot, job)
+
+    def pending(self) -> bool:
+        """Whether jobs are waiting, an unreachable or misbehaving queue counts as empty."""
+        try:
+            return bool(self.has_pending())
+        except Exception as e:
+            logger.warning(f'Could not check the job queue: {e!r}')
+            return False
+
+    def scale(self):
+        """Add a child while jobs are pending and the host has headroom, retire an idle one when the queue is empty."""
+        active = [slot for slot, (_, retire) in self.children.items() if not retire.is_set()]
+        if len(active) < self.min_workers:
+            self.spawn(self.free_slot())
+        elif self.pending():
+            if len(active) < self.capacity():
+                self.spawn(self.free_slot())
+        elif len(active) > self.min_workers:
+            idle = [slot for slot in active if slot not in self.claims]
+            if idle:
+                self.children[idle[-1]][1].set()
+                logger.info(f'Retiring child {idle[-1]}')
+
+    def run(self, resume: list = ()):
+        """Supervise until interrupted. Jobs in `resume` were claimed before a restart and each get a child first."""
+        logger.info(f'Supervisor started with {self.context.get_start_method()} children, model {"shared" if self.shared_model else "per child"}')
+        for job in resume:
+            self.spawn(self.free_slot(), job)
+        try:
+            while True:
+                # A failing tick is retried on the next one, the children keep running meanwhile
+                try:
+                    if self.on_tick is not None:
+                        self.on_tick()
+                    self.reap()
+                    self.scale()
+                except Exception:
+                    logger.exception('Supervisor tick failed')
+                time.sleep(POLL_INTERVAL)
+        finally:
+            for process, retire in self.children.values():
+                retire.set()
+            for process, _ in self.children.values():
+                process.join()
+            self.manager.shutdown()
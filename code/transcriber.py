@@ -0,0 +1,476 @@
+import os
+import json
+import time
+import queue
+import difflib
+import importlib.util
+import logging
+import argparse
+import threading
+import urllib.parse
+import multiprocessing
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# PyTorch
+import torch
+
+# OpenAI Whisper Model PyTorch
+import stable_whisper as whisper
+
+# vad.py
+from vad import load_audio, remap_result, speech_regions, trim
+
+logger = logging.getLogger(__name__)
+
+# Where clients look for the transcription server
+TRANSCRIBER_URL = os.getenv('TRANSCRIBER_URL', 'http://127.0.0.1:8765')
+# A server started by a worker binds where its clients look for it
+SERVER_HOST = urllib.parse.urlsplit(TRANSCRIBER_URL).hostname or '127.0.0.1'
+SERVER_PORT = urllib.parse.urlsplit(TRANSCRIBER_URL).port or 8765
+# Seconds a client waits to connect before falling back to in-process transcription
+CONNECT_TIMEOUT = 0.5
+# Seconds a starting server may take to load its models and answer /health
+SERVER_START_TIMEOUT = 600
+# Seconds one backend may take to load and transcribe the benchmark audio
+BENCHMARK_TIMEOUT = 3600
+
+# Inference backend: stock PyTorch, int8 dynamic quantization of the linear
+# layers, or CTranslate2 through faster-whisper when it is installed
+BACKENDS = ('torch', 'int8', 'ctranslate2')
+WHISPER_BACKEND = os.getenv('WHISPER_BACKEND', 'torch')
+# Intra-op threads used by the backend, 0 keeps the library default
+WHISPER_THREADS = int(os.getenv('WHISPER_THREADS', '0'))
+
+MODELS = {}
+
+
+def inference_backend(backend: str = None) -> str:
+    """Return the backend that actually runs for `backend`, ctranslate2 falls back to int8 without faster-whisper."""
+    backend = backend or WHISPER_BACKEND
+    if backend == 'ctranslate2' and importlib.util.find_spec('faster_whisper') is None:
+        return 'int8'
+    return backend
+
+
+def plain_linears(module):
+    """Replace every subclass of nn.Linear in module, e.g. whisper.model.Linear, by an nn.Linear sharing its weights."""
+    for name, child in module.named_children():
+        if isinstance(child, torch.nn.Linear) and type(child) is not torch.nn.Linear:
+            linear = torch.nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+            linear.weight = child.weight
+            linear.bias = child.bias
+            setattr(module, name, linear)
+        else:
+            plain_linears(child)
+    return module
+
+
+def quantize_int8(loaded):
+    """
+    Quantize_int8 is a function that stores the weights of every linear layer of a model as int8, the activations are quantized on the fly.
+
+    quantize_dynamic only swaps modules whose type is exactly nn.Linear, Whisper's layers are a subclass of it and would all stay fp32, so they are turned into plain nn.Linear first.
+
+    Args:
+        loaded: A Whisper model on the CPU.
+
+    Returns:
+        The quantized model.
+
+    """
+    return torch.quantization.quantize_dynamic(plain_linears(loaded), {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def load_model(model: str, backend: str = None, threads: int = None, cache: bool = True):
+    """
+    Load_model is a function that loads a Whisper model once per process and backend. Models loaded before a fork are shared with the children.
+
+    Args:
+        model (str): The Whisper model name.
+        backend (str): One of BACKENDS. Default value is WHISPER_BACKEND.
+        threads (int): Intra-op threads, 0 for the library default. Default value is WHISPER_THREADS.
+        cache (bool): Keep the model in MODELS for the next call. Default value is True.
+
+    Returns:
+        The loaded model.
+
+    """
+    backend = backend or WHISPER_BACKEND
+    threads = WHISPER_THREADS if threads is None else threads
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    if (model, backend) in MODELS:
+        return MODELS[(model, backend)]
+
+    if threads:
+        torch.set_num_threads(threads)
+
+    if backend == 'ctranslate2':
+        try:
+            loaded = whisper.load_faster_whisper(model, device='cpu', compute_type='int8', cpu_threads=threads)
+        except ImportError:
+            logger.warning('faster-whisper is not installed, using the int8 PyTorch backend')
+            loaded = load_model(model, 'int8', threads, cache)
+            if cache:
+                MODELS[(model, backend)] = loaded
+            return loaded
+    else:
+        loaded = whisper.load_model(model, device='cpu' if backend == 'int8' else None)
+        if backend == 'int8':
+            loaded = quantize_int8(loaded)
+
+    if cache:
+        MODELS[(model, backend)] = loaded
+    return loaded
+
+
+def _run_model(loaded, backend: str, audio, **options):
+    if hasattr(loaded, 'transcribe_stable'):
+        # faster-whisper model wrapped by stable_whisper
+        return loaded.transcribe_stable(audio, **options)
+    fp16 = backend == 'torch' and torch.cuda.is_available()
+    return loaded.transcribe(audio, fp16=fp16, **options)
+
+
+def transcribe_local(model: str, filename: str, backend: str = None, vad: bool = False, cache: bool = True, **options):
+    """
+    Transcribe_local is a function that transcribes an audio file with a model loaded in this process.
+
+    With `vad`, an energy detector first finds the speech regions, only those (and at most vad.KEEP_SILENCE of every pause) are handed to the model, and the timestamps are mapped back to the original timeline. The fraction of audio skipped is stored on the result as `vad_skipped`.
+
+    Args:
+        model (str): The Whisper model name.
+        filename (str): A string representing the path of the audio file.
+        backend (str): One of BACKENDS. Default value is WHISPER_BACKEND.
+        vad (bool): Transcribe only the speech regions. Default value is False.
+        cache (bool): Keep the model loaded for the next call. Default value is True.
+        **options: Keyword arguments for model.transcribe.
+
+    Returns:
+        WhisperResult: The transcription with word timestamps.
+
+    """
+    backend = backend or WHISPER_BACKEND
+    loaded = load_model(model, backend, cache=cache)
+
+    audio = load_audio(filename) if vad else None
+    regions = speech_regions(audio) if vad else []
+    if len(regions) == 0:
+        result = _run_model(loaded, backend, filename, **options)
+        result.vad_skipped = 0.0
+        return result
+
+    trimmed, offsets = trim(audio, regions)
+    result = _run_model(loaded, backend, trimmed, **options)
+    result = whisper.WhisperResult(remap_result(result.to_dict(), regions, offsets))
+    result.vad_skipped = 1 - len(trimmed) / len(audio)
+    logger.info(f'VAD skipped {result.vad_skipped:.1%} of {filename}')
+    return result
+
+
+def transcribe(model: str, filename: str, **options):
+    """
+    Transcribe is a function that takes in a model name, an audio file and transcribe options, and returns a stable_whisper WhisperResult. The request goes to the local transcription server when one is running, so the process does not hold its own copy of the model; otherwise the model is loaded in-process.
+
+    A process whose server is only briefly down, e.g. while it is restarted, sets TRANSCRIBER_CACHE_FALLBACK=0 so the model loaded for the fallback is freed after the call instead of staying resident next to the server's.
+
+    Args:
+        model (str): The Whisper model name, e.g. "small.en".
+        filename (str): A string representing the path of the audio file, readable by the server.
+        **options: JSON serializable keyword arguments for model.transcribe.
+
+    Returns:
+        WhisperResult: The transcription with word timestamps.
+
+    """
+    try:
+        response = requests.post(f"{TRANSCRIBER_URL}/transcribe", json={
+            'model': model,
+            'audio': os.path.abspath(filename),
+            'options': options,
+        }, timeout=(CONNECT_TIMEOUT, None))
+    except requests.exceptions.ConnectionError:
+        logger.info('Transcription server not available, transcribing in-process')
+        cache = os.getenv('TRANSCRIBER_CACHE_FALLBACK', '1') != '0'
+        return transcribe_local(model, filename, cache=cache, **options)
+    response.raise_for_status()
+    data = response.json()
+    vad_skipped = data.pop('vad_skipped', 0.0)
+    result = whisper.WhisperResult(data)
+    result.vad_skipped = vad_skipped
+    return result
+
+
+class InferenceQueue:
+    """
+    Serves the transcription requests of all clients one at a time, in arrival order, on a single inference thread.
+
+    Whisper decodes every audio on its own, so requests are not batched; serializing them keeps concurrent clients from contending for the cores or the GPU.
+    """
+
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, model: str, audio: str, options: dict) -> Future:
+        future = Future()
+        self.requests.put((model, audio, options, future))
+        return future
+
+    def run(self):
+        while True:
+            model, audio, options, future = self.requests.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            logger.info(f'Transcribing {audio} with {model}, {self.requests.qsize()} requests waiting')
+            try:
+                result = transcribe_local(model, audio, **options)
+                future.set_result({**result.to_dict(), 'vad_skipped': result.vad_skipped})
+            except Exception as e:
+                logger.exception(e)
+                future.set_exception(e)
+
+
+class TranscriptionHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status: int, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'models': sorted(f'{model}:{backend}' for model, backend in MODELS)})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/transcribe':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            future = self.server.inference.submit(request['model'], request['audio'], request.get('options', {}))
+            self.send_json(200, future.result())
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(models: list, host: str = SERVER_HOST, port: int = SERVER_PORT):
+    """
+    Serve is a function that loads the given Whisper models and serves transcriptions over HTTP until interrupted.
+
+    Args:
+        models (list): The model names loaded at start; others are loaded on first use.
+        host (str): The address to bind. Default value is the host of TRANSCRIBER_URL.
+        port (int): The port to bind. Default value is the port of TRANSCRIBER_URL.
+
+    """
+    for model in models:
+        load_model(model)
+    server = ThreadingHTTPServer((host, port), TranscriptionHandler)
+    server.inference = InferenceQueue()
+    logger.info(f'Transcription server listening on {host}:{port} with {", ".join(models)}')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def wait_for_server(timeout: float = SERVER_START_TIMEOUT, process=None) -> bool:
+    """
+    Wait_for_server is a function that polls the /health endpoint of the transcription server until it answers.
+
+    Args:
+        timeout (float): The seconds to wait at most. Default value is SERVER_START_TIMEOUT.
+        process: The process running the server, waiting stops early when it exits.
+
+    Returns:
+        bool: Whether the server is up.
+
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and not process.is_alive():
+            return False
+        try:
+            if requests.get(f"{TRANSCRIBER_URL}/health", timeout=CONNECT_TIMEOUT).status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(1)
+    return False
+
+
+class ServerProcess:
+    """
+    Runs the transcription server in a process of its own and starts it again when it dies.
+
+    The clients fall back to in-process transcription while the server is down, so a restart only costs time. A restart does not wait for the models to load, the supervisor keeps reaping and scaling its children meanwhile.
+    """
+
+    def __init__(self, models: list):
+        self.models = models
+        self.process = None
+
+    def start(self, wait: bool = True) -> bool:
+        """Start the server and, with wait, wait until it has loaded its models. Return whether it is known to be up."""
+        self.process = multiprocessing.Process(target=serve, args=(self.models, SERVER_HOST, SERVER_PORT), daemon=True)
+        self.process.start()
+        if not wait:
+            return False
+        if wait_for_server(process=self.process):
+            logger.info(f'Transcription server ready (pid {self.process.pid})')
+            return True
+        if not self.process.is_alive():
+            logger.error(f'Transcription server exited with code {self.process.exitcode} while starting')
+        else:
+            logger.error(f'Transcription server did not come up within {SERVER_START_TIMEOUT} seconds')
+        return False
+
+    def check(self):
+        """Restart the server if it exited, without waiting for it."""
+        if self.process is not None and self.process.is_alive():
+            return
+        if self.process is not None:
+            logger.warning(f'Transcription server exited with code {self.process.exitcode}, restarting it')
+        self.start(wait=False)
+
+
+def result_words(result) -> list:
+    return [(word.word, word.start, word.end) for segment in result.segments for word in segment.words]
+
+
+def timing_drift(baseline: list, words: list) -> dict:
+    """
+    Timing_drift is a function that takes in two word lists, aligns them on their text and returns the mean and max absolute difference of the word start and end times of the aligned words, in seconds.
+
+    Args:
+        baseline (list): The (word, start, end) tuples of the reference transcription.
+        words (list): The (word, start, end) tuples to compare.
+
+    Returns:
+        dict: The mean and max drift and the fraction of baseline words aligned.
+
+    """
+    def normalize(items): return [word.strip().lower() for word, _, _ in items]
+    matcher = difflib.SequenceMatcher(a=normalize(baseline), b=normalize(words), autojunk=False)
+    drifts = []
+    for block in matcher.get_matching_blocks():
+        for offset in range(block.size):
+            _, start_a, end_a = baseline[block.a + offset]
+            _, start_b, end_b = words[block.b + offset]
+            drifts += [abs(start_a - start_b), abs(end_a - end_b)]
+    return {
+        'mean_drift': sum(drifts) / len(drifts) if drifts else float('nan'),
+        'max_drift': max(drifts, default=float('nan')),
+        'aligned': len(drifts) / 2 / len(baseline) if baseline else 0.0,
+    }
+
+
+def _benchmark_backend(model: str, backend: str, threads: int, audio: str, results):
+    # Unix only, imported here so the module still loads on Windows
+    import resource
+
+    start = time.perf_counter()
+    load_model(model, backend, threads)
+    loaded = time.perf_counter()
+    result = transcribe_local(model, audio, backend=backend, regroup=True)
+    done = time.perf_counter()
+    results.put({
+        'backend': backend,
+        'load': loaded - start,
+        'latency': done - loaded,
+        'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'words': result_words(result),
+    })
+
+
+def _benchmark_result(process, results, timeout: float = BENCHMARK_TIMEOUT):
+    # A backend that crashes (e.g. killed for memory) never puts its row, do not wait on it forever
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return results.get(timeout=1)
+        except queue.Empty:
+            if not process.is_alive():
+                break
+    else:
+        logger.error(f'Benchmark process {process.pid} did not finish within {timeout} seconds')
+        process.terminate()
+        return None
+    # The row may still be in the pipe after the process exited
+    try:
+        return results.get(timeout=1)
+    except queue.Empty:
+        return None
+
+
+def benchmark(audio: str, model: str = 'small', backends: list = BACKENDS, threads: int = WHISPER_THREADS) -> list:
+    """
+    Benchmark is a function that transcribes one audio file with every backend, each in a fresh process so the peak RSS is its own, and compares latency, peak RSS and word timing drift against the first backend.
+
+    Args:
+        audio (str): A string representing the path of the audio file.
+        model (str): The Whisper model name.
+        backends (list): The backends to compare, the first one is the baseline.
+        threads (int): Intra-op threads given to every backend.
+
+    Returns:
+        list: One dictionary per backend.
+
+    """
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    for backend in backends:
+        results = context.Queue()
+        process = context.Process(target=_benchmark_backend, args=(model, backend, threads, audio, results))
+        process.start()
+        row = _benchmark_result(process, results)
+        process.join()
+        if row is None:
+            raise RuntimeError(f"benchmark of the {backend} backend exited with code {process.exitcode} without a result")
+        rows.append(row)
+    baseline = rows[0]['words']
+    for row in rows:
+        row.update(timing_drift(baseline, row.pop('words')))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Whisper transcription server shared by all workers")
+    parser.add_argument("--models", nargs='+', default=["small", "small.en"],
+                        help="Models loaded at start", type=str)
+    parser.add_argument("--backend", default=WHISPER_BACKEND, choices=BACKENDS,
+                        help="Inference backend", type=str)
+    parser.add_argument("--threads", default=WHISPER_THREADS,
+                        help="Intra-op threads, 0 for the library default", type=int)
+    parser.add_argument("--host", default=SERVER_HOST, help="Address to bind (Default: host of TRANSCRIBER_URL)", type=str)
+    parser.add_argument("--port", default=SERVER_PORT, help="Port to bind (Default: port of TRANSCRIBER_URL)", type=int)
+    parser.add_argument("--benchmark", metavar='AUDIO',
+                        help="Compare the backends on an audio file instead of serving", type=str)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.benchmark:
+        baseline = 'torch'
+        backends = [baseline] + [backend for backend in BACKENDS if backend != baseline]
+        print(f"{'backend':>12} {'load s':>8} {'latency s':>10} {'peak RSS MB':>12} {'mean drift s':>13} {'max drift s':>12} {'aligned':>8}")
+        for row in benchmark(args.benchmark, args.models[0], backends, args.threads):
+            print(f"{row['backend']:>12} {row['load']:>8.2f} {row['latency']:>10.2f} {row['rss'] / 1024 ** 2:>12.0f} "
+                  f"{row['mean_drift']:>13.3f} {row['max_drift']:>12.3f} {row['aligned']:>8.1%}")
+    else:
+        WHISPER_BACKEND = args.backend
+        WHISPER_THREADS = args.threads
+        serve(args.models, args.host, args.port)
@@ -0,0 +1,101 @@
+import subprocess
+from typing import Tuple
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+# Analysis frame length in seconds
+FRAME = 0.02
+# Frames quieter than the loud reference minus this many dB are silence
+THRESHOLD_DB = 35
+# Floor under which a frame is always silence, in dBFS
+FLOOR_DB = -60
+# Silences shorter than this are kept inside a speech region, in seconds
+MIN_SILENCE = 0.3
+# Padding added around every speech region, in seconds
+PAD = 0.1
+# Longest silence kept between two regions in the trimmed audio, in seconds
+KEEP_SILENCE = 0.5
+
+
+def load_audio(filename: str, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """Decode any audio file to mono float32 samples in [-1, 1] with ffmpeg."""
+    output = subprocess.run(["ffmpeg", "-nostdin", "-v", "error", "-i", filename, "-f", "s16le", "-ac", "1", "-ar", str(sr), "-"],
+                            capture_output=True, check=True).stdout
+    return np.frombuffer(output, np.int16).astype(np.float32) / 32768.0
+
+
+def speech_regions(audio: np.ndarray, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Speech_regions is a function that takes in mono samples and returns the regions holding speech, found with a frame energy detector. Every step is a NumPy array operation, there is no Python loop over frames.
+
+    Args:
+        audio (np.ndarray): The mono float32 samples.
+        sr (int): The sample rate.
+
+    Returns:
+        np.ndarray: An (n, 2) array of region start and end times in seconds, sorted and disjoint.
+
+    """
+    hop = int(sr * FRAME)
+    frames = len(audio) // hop
+    if frames == 0:
+        return np.empty((0, 2))
+
+    energy = np.sqrt(np.mean(audio[:frames * hop].reshape(frames, hop) ** 2, axis=1))
+    db = 20 * np.log10(np.maximum(energy, 1e-10))
+    threshold = max(np.percentile(db, 95) - THRESHOLD_DB, FLOOR_DB)
+    speech = db > threshold
+    if not speech.any():
+        return np.empty((0, 2))
+
+    # Run boundaries of the speech mask, as frame indexes
+    edges = np.diff(np.concatenate(([0], speech.astype(np.int8), [0])))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+    # Close the short silences, then pad and merge what now overlaps
+    keep = np.concatenate(([True], (starts[1:] - ends[:-1]) * FRAME >= MIN_SILENCE))
+    starts = starts[keep]
+    ends = np.concatenate((ends[np.flatnonzero(keep[1:])], ends[-1:]))
+
+    duration = len(audio) / sr
+    starts = np.maximum(starts * FRAME - PAD, 0.0)
+    ends = np.minimum(ends * FRAME + PAD, duration)
+    first = np.flatnonzero(np.concatenate(([True], starts[1:] > ends[:-1])))
+    return np.stack((starts[first], np.maximum.reduceat(ends, first)), axis=1)
+
+
+def trim(audio: np.ndarray, regions: np.ndarray, sr: int = SAMPLE_RATE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Trim is a function that takes in samples and their speech regions, and returns the samples with leading and trailing silence removed and every inner silence shortened to at most KEEP_SILENCE, along with the start of every region in the trimmed timeline.
+
+    Args:
+        audio (np.ndarray): The mono float32 samples.
+        regions (np.ndarray): The (n, 2) speech regions in seconds.
+        sr (int): The sample rate.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The trimmed samples and the region starts in the trimmed timeline.
+
+    """
+    gaps = np.minimum(regions[1:, 0] - regions[:-1, 1], KEEP_SILENCE)
+    # Each region is followed by the silence kept before the next one
+    spans = np.stack((regions[:, 0], regions[:, 1] + np.append(gaps, 0.0)), axis=1)
+    samples = np.round(spans * sr).astype(np.int64)
+    trimmed = np.concatenate([audio[start:end] for start, end in samples])
+    offsets = np.concatenate(([0], np.cumsum(samples[:, 1] - samples[:, 0])[:-1])) / sr
+    return trimmed, offsets
+
+
+def remap(times: np.ndarray, regions: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Map times of the trimmed timeline back to the original one."""
+    index = np.clip(np.searchsorted(offsets, times, side='right') - 1, 0, len(offsets) - 1)
+    return regions[index, 0] + (times - offsets[index])
+
+
+def remap_result(result: dict, regions: np.ndarray, offsets: np.ndarray) -> dict:
+    """Map the segment and word timestamps of a WhisperResult dictionary back to the original timeline, in place."""
+    for segment in result['segments']:
+        for item in [segment] + segment.get('words', []):
+            item['start'], item['end'] = remap(np.array([item['start'], item['end']]), regions, offsets).tolist()
+    return result
@@ -23,10 +23,6 @@ import torch
 # ENV
 from dotenv import load_dotenv, find_dotenv
 
-# OpenAI Whisper Model PyTorch
-# import whisper
-import stable_whisper as whisper
-
 # MicrosoftEdge TTS
 import edge_tts
 from edge_tts import VoicesManager
@@ -40,12 +36,46 @@ from utils import *
 # msg.py
 import msg
 
+# build.py
+from build import BuildState, audio_inputs, caption_inputs, subtitle_inputs, transcript_inputs, video_inputs
+
+# backgrounds.py
+from backgrounds import load_metadata, pick_offset, save_metadata
+
+# encoders.py
+from encoders import encode_path
+
+# budget.py
+from budget import UsageMeter, admit, corrections, estimate, headroom, job_features
+
+# journal.py
+from journal import DONE, FAILED, MAX_ATTEMPTS, RELEASED, Journal
+
+# supervisor.py
+from supervisor import CORES_PER_WORKER, Supervisor
+
+# transcriber.py
+from transcriber import MODELS, ServerProcess, inference_backend, load_model, transcribe as transcribe_audio
+
+# subtitles.py
+from subtitles import HOUSE_STYLE, ass_filter, load_words, save_words, segments_from_result, write_ass
+
+# captions.py
+from captions import regroup
+
+# sinks.py
+from sinks import FRAGMENTED_MP4, PUMP_INTERVAL, get_sink
+
 HOME = os.getcwd()
 VIDGEN_API = os.getenv('BASE_URL') + "/api"
 
 if not VIDGEN_API:
     raise Exception("BASE_URL environment variable not set, please set it to the VIDGEN api")
 
+# Local journal of the claimed jobs, survives worker crashes
+JOURNAL_PATH = os.getenv('WORKER_JOURNAL', f"{HOME}{os.sep}journal.sqlite")
+BACKGROUNDS_DIR = f"{HOME}{os.sep}backgrounds"
+
 # Logging
 if not os.path.isdir('log'):
     os.mkdir('log')
@@ -63,6 +93,38 @@ with KeepDir() as keep_dir:
     logger = logging.getLogger(__name__)
 
 
+###########################
+#      RENDER SETTINGS    #
+###########################
+
+# Whisper model size used for every job
+WORKER_MODEL = "small"
+# Set when the models are loaded before the children fork, or served by the transcription server
+MODELS_PRELOADED = False
+
+# Options of the Whisper transcription, vad skips the silences of the TTS audio
+TRANSCRIBE_OPTIONS = {
+    'regroup': True,
+    'vad': True,
+}
+
+# Caption grouping applied on top of the Whisper word timestamps
+CAPTION_GROUPING = {
+    'split_by_gap': 0.5,
+    'split_by_length': 38,
+    'merge_by_gap': 0.15,
+    'merge_max_words': 2,
+}
+
+# FFMPEG output codecs
+ENCODER_PROFILE = [
+    "-c:v", "libx264",
+    "-crf", "23",  # Adjust the CRF value as needed
+    "-c:a", "aac",
+    "-ac", "2",  # Use stereo audio
+    "-b:a", "192K",  # Adjust audio bitrate as needed
+]
+
 
 #######################
 #         CODE        #
@@ -71,6 +133,9 @@ with KeepDir() as keep_dir:
 def update_job_status(job_id:str, status: str):
     requests.put(VIDGEN_API + "/jobs/" + job_id, json={"status": status})
 
+# Jobs claimed in the journal by pick_job in this process and not started yet
+PICKED = set()
+
 def pick_job() -> str:
     response = requests.get(VIDGEN_API + "/jobs/pick")
 
@@ -81,26 +146,127 @@ def pick_job() -> str:
             return None
 
         job_id = job['_id']
-        update_job_status(job_id, "rendering")
+        # Leave the job in the queue for another worker when this host cannot fit it now,
+        # counting the jobs other children admitted but may not have started yet
+        _, needed = job_budget(job)
+        journal = get_journal()
+        with journal.transaction():
+            fits, missing = admit(needed, headroom(HOME, journal.reserved()))
+            if fits:
+                # Claimed in the journal before the API hears of it, a crash in between leaves
+                # a journal entry to resume from instead of a job stuck in "rendering"
+                journal.reserve(job_id, needed)
+                journal.claim(job)
+        if not fits:
+            console.log(f"{msg.WARNING}Not enough headroom for job {job_id}: {', '.join(missing)}")
+            logger.info(f"Not enough headroom for job {job_id}: {', '.join(missing)}")
+            return None
+
+        try:
+            update_job_status(job_id, "rendering")
+        except Exception:
+            journal.release(job_id)
+            journal.finish(job_id, RELEASED)
+            raise
+        PICKED.add(job_id)
         return job
     else:
         return None
 
-def update_download_url(job_id, video_name):
-    download_url = '/renders/' + video_name
-    
+def has_pending_job() -> bool:
+    # Same endpoint as pick_job, but the job is not marked as rendering
+    try:
+        response = requests.get(VIDGEN_API + "/jobs/pick", timeout=30)
+        return response.status_code == 200 and "error" not in response.json()
+    except (requests.RequestException, ValueError) as e:
+        logger.warning(f'Could not check the job queue: {e!r}')
+        return False
+
+def fail_job(job):
+    update_job_status(job["_id"], "error")
+
+def update_download_url(job_id, download_url):
     console.log("Updating Download URL", download_url)
     requests.put(VIDGEN_API + "/jobs/" + job_id, json={"finished_video": download_url})
     update_job_status(job_id, "done")
 
-async def main() -> bool:
-    job = pick_job()
+def job_model(job: dict) -> str:
+    if WORKER_MODEL == "large" or job["language"].split("-")[0] != "en":
+        return WORKER_MODEL
+    return WORKER_MODEL + ".en"
+
+def job_budget(job: dict) -> Tuple[dict, dict]:
+    """
+    Job_budget is a function that takes in a job before it is claimed, and estimates its memory, CPU-seconds and scratch disk from the length of its text, the model size and the cached metadata of its background, corrected by the usage of the previous jobs recorded in the journal.
+
+    Args:
+        job (dict): The job returned by the VIDGEN API.
+
+    Returns:
+        Tuple[dict, dict]: The features of the job and its estimate.
+
+    """
+    model = job_model(job)
+    model_loaded = MODELS_PRELOADED or any(name == model for name, _ in MODELS)
+    text = f"{job['series']}.\n{job['text']}\n{job['outro']}"
+    features = job_features(text, model, load_metadata(BACKGROUNDS_DIR, job["background_url"]), model_loaded)
+    return features, estimate(features, corrections(get_journal()))
+
+JOURNALS = {}
+
+def get_journal() -> Journal:
+    # SQLite connections must not cross a fork, open one per process
+    if os.getpid() not in JOURNALS:
+        JOURNALS[os.getpid()] = Journal(JOURNAL_PATH)
+    return JOURNALS[os.getpid()]
+
+def recover_jobs() -> list:
+    """
+    Recover_jobs is a function that goes through the jobs the journal says this worker had claimed but never finished, deletes their partial files, and returns the ones to resume. A job that already crashed MAX_ATTEMPTS times is released by reporting an error to the API instead. Files of failed and released jobs are garbage-collected.
+
+    Returns:
+        list: The jobs to render again, their completed stages are reused.
+
+    """
+    journal = get_journal()
+    resumed = []
+    for job in journal.unfinished():
+        for artifact in journal.partial_artifacts(job['_id']):
+            if os.path.isfile(artifact):
+                os.remove(artifact)
+                logger.info(f'Removed partial file {artifact}')
+        if journal.attempts(job['_id']) >= MAX_ATTEMPTS:
+            console.log(f"{msg.WARNING}Releasing job {job['_id']} after {MAX_ATTEMPTS} attempts")
+            logger.warning(f"Releasing job {job['_id']} after {MAX_ATTEMPTS} attempts")
+            journal.finish(job['_id'], RELEASED)
+            update_job_status(job['_id'], "error")
+        else:
+            console.log(f"{msg.OK}Resuming job {job['_id']}, completed stages: {', '.join(journal.stages(job['_id'])) or 'none'}")
+            logger.info(f"Resuming job {job['_id']}")
+            resumed.append(job)
+    for artifact in journal.collect_garbage():
+        logger.info(f'Removed orphaned file {artifact}')
+    return resumed
+
+async def main(job: dict = None) -> bool:
+    if job is None:
+        job = pick_job()
 
     if job:    
+        journal = get_journal()
+        # A job resumed after a crash counts one more attempt
+        if job["_id"] in PICKED:
+            PICKED.discard(job["_id"])
+        else:
+            journal.claim(job)
         try:
+            features, needed = job_budget(job)
+            # A resumed job was not admitted by pick_job, it holds its estimate from here
+            journal.reserve(job["_id"], needed)
+            meter = UsageMeter()
             pprint(job)  
             args = {
-                "model": "small",
+                "model": WORKER_MODEL,
                 "non_english": True if job["language"].split("-")[0] != "en" else False,
                 "url": job["background_url"],
                 "tts": job["tts"],
@@ -152,16 +318,21 @@ async def main() -> bool:
                     logger.warning('PyTorch GPU not found')
 
                 background_mp4 = download_video(url=args["url"])
+                background_path = f"{BACKGROUNDS_DIR}{os.sep}{background_mp4}"
+                if load_metadata(BACKGROUNDS_DIR, args["url"]).get('filename') != background_path:
+                    # Lets the next job with this background be costed before it is claimed
+                    background_info = get_info(background_mp4)
+                    save_metadata(BACKGROUNDS_DIR, args["url"], {
+                        'filename': background_path,
+                        'size': os.path.getsize(background_path),
+                        **{key: background_info[key] for key in ('width', 'height') if key in background_info},
+                    })
 
                 console.log("background_mp4", background_mp4)
                 # OpenAI-Whisper Model
                 model = args["model"]
                 if args["model"] != "large" and not args["non_english"]:
                     model = args["model"] + ".en"
-                whisper_model = whisper.load_model(model)
-
-                console.log(f"{msg.OK}OpenAI-Whisper model loaded")
-                logger.info('OpenAI-Whisper model loaded')
 
                 series = args['series']
                 part = args['part']
@@ -171,44 +342,114 @@ async def main() -> bool:
 
                 req_text, filename = create_full_text(
                     path, series, part, text, outro)
+                srt_filename = f"{filename[:-len('.mp3')]}.srt"
+                ass_filename = f"{filename[:-len('.mp3')]}.ass"
+                words_filename = f"{filename[:-len('.mp3')]}.words.json"
+                final_video = video_filename(srt_filename)
+                journal.plan(job["_id"], [filename, srt_filename, words_filename, ass_filename, final_video])
+
+                # A streaming sink uploads the mp4 while it is encoded, which needs a fragmented mp4
+                sink = get_sink()
+                encoder = ENCODER_PROFILE + FRAGMENTED_MP4 if sink.streaming else ENCODER_PROFILE
+                render_path = encode_path(encoder)
+
+                build = BuildState(os.path.dirname(filename))
+                mp3_inputs = audio_inputs(req_text, args["tts"])
+                words_inputs = transcript_inputs(mp3_inputs, model, TRANSCRIBE_OPTIONS, inference_backend())
+                srt_inputs = caption_inputs(mp3_inputs, model, CAPTION_GROUPING, TRANSCRIBE_OPTIONS, inference_backend())
+                ass_inputs = subtitle_inputs(srt_inputs, HOUSE_STYLE)
+                mp4_inputs = video_inputs(
+                    ass_inputs, background_mp4, render_path['output_args'], [render_path['blur'], render_path['subtitles']])
+
+                if build.is_stale(filename, mp3_inputs):
+                    console.log(f"{msg.OK}Text converted successfully")
+                    logger.info('Text converted successfully')
+
+                    await tts(req_text, outfile=filename, voice=args["tts"], random_voice=args["random_voice"], args=args)
+                    build.record(filename, mp3_inputs)
 
-                console.log(f"{msg.OK}Text converted successfully")
-                logger.info('Text converted successfully')
-
-                await tts(req_text, outfile=filename, voice=args["tts"], random_voice=args["random_voice"], args=args)
-
-                console.log(
-                    f"{msg.OK}Text2Speech mp3 file generated successfully!")
-                logger.info('Text2Speech mp3 file generated successfully!')
-
-                # Whisper Model to create SRT file from Speech recording
-                srt_filename = srt_create(
-                    whisper_model, path, series, part, text, filename)
+                    console.log(
+                        f"{msg.OK}Text2Speech mp3 file generated successfully!")
+                    logger.info('Text2Speech mp3 file generated successfully!')
+                else:
+                    logger.info(f'Reusing up to date {filename}')
+                journal.complete_stage(job["_id"], "tts", filename)
 
-                console.log(
-                    f"{msg.OK}Transcription srt and ass file saved successfully!")
-                logger.info('Transcription srt and ass file saved successfully!')
+                if build.is_stale(words_filename, words_inputs):
+                    # Whisper Model to create SRT file from Speech recording
+                    srt_filename = srt_create(
+                        model, path, series, part, text, filename)
+                    build.record(words_filename, words_inputs)
+                    build.record(srt_filename, srt_inputs)
+                    build.record(ass_filename, ass_inputs)
 
-                # Background video with srt and duration
-                file_info = get_info(background_mp4, verbose=args["verbose"])
+                    console.log(
+                        f"{msg.OK}Transcription srt and ass file saved successfully!")
+                    logger.info('Transcription srt and ass file saved successfully!')
+                elif build.is_stale(srt_filename, srt_inputs) or build.is_stale(ass_filename, ass_inputs):
+                    # Only the grouping or the style changed, regroup the saved word timings
+                    captions = regroup(load_words(words_filename), CAPTION_GROUPING)
+                    captions.to_srt(srt_filename, word_level=True)
+                    write_ass(captions.segments(), ass_filename, style=HOUSE_STYLE)
+                    build.record(srt_filename, srt_inputs)
+                    build.record(ass_filename, ass_inputs)
+
+                    console.log(f"{msg.OK}Subtitles regrouped successfully!")
+                    logger.info('Subtitles regrouped successfully!')
+                else:
+                    logger.info(f'Reusing up to date {srt_filename}')
+                journal.complete_stage(job["_id"], "srt", srt_filename)
+                journal.complete_stage(job["_id"], "words", words_filename)
+                journal.complete_stage(job["_id"], "ass", ass_filename)
 
-                final_video = prepare_background(
-                    background_mp4, filename_mp3=filename, filename_srt=srt_filename, duration=int(file_info.get('duration')), verbose=args["verbose"])
+                upload = sink.open(final_video)
+                try:
+                    if build.is_stale(final_video, mp4_inputs):
+                        # Background video with srt and duration
+                        file_info = get_info(background_mp4, verbose=args["verbose"])
 
-                console.log(
-                    f"{msg.OK}MP4 video saved successfully!\nPath: {final_video}")
-                logger.info(f'MP4 video saved successfully!\nPath: {final_video}')
+                        final_video = prepare_background(
+                            background_mp4, filename_mp3=filename, filename_srt=srt_filename, duration=int(file_info.get('duration')), verbose=args["verbose"], encoder=encoder, upload=upload)
+                        build.record(final_video, mp4_inputs)
 
-            update_download_url(job["_id"], final_video.split("/")[-1])    
+                        console.log(
+                            f"{msg.OK}MP4 video saved successfully!\nPath: {final_video}")
+                        logger.info(f'MP4 video saved successfully!\nPath: {final_video}')
+                    else:
+                        console.log(
+                            f"{msg.OK}MP4 video up to date\nPath: {final_video}")
+                        logger.info(f'MP4 video up to date\nPath: {final_video}')
+                    journal.complete_stage(job["_id"], "video", final_video)
+
+                    actual = meter.stop([filename, srt_filename, words_filename, ass_filename, final_video], download=features['download'])
+                    journal.record_usage(job["_id"], features, needed, actual)
+                    logger.info(f'Job {job["_id"]} used ' + ', '.join(
+                        f'{name} {actual[name]:.0f} (estimated {needed[name]:.0f})' for name in actual))
+                except Exception:
+                    # finish() aborts on its own failures, anything before it leaves the upload to abort here
+                    upload.abort()
+                    raise
+
+                # Uploads what is left, verifies it and applies the retention policy
+                download_url = upload.finish()
+                journal.complete_stage(job["_id"], "upload", download_url)
+
+            update_download_url(job["_id"], download_url)
+            journal.finish(job["_id"], DONE)
 
             console.log(f'{msg.DONE}')
             return True
-        except:
+        except Exception as e:
+            console.log(f"{msg.ERROR}{e}")
+            logger.exception(e)
+            journal.finish(job["_id"], FAILED)
             update_job_status(job["_id"], "error")
+        finally:
+            journal.release(job["_id"])
 
 
 
-def download_video(url: str, folder: str = 'backgrounds'):
+def download_video(url: str, folder: str = BACKGROUNDS_DIR):
     if not os.path.isdir(folder):
         os.mkdir(folder)
     with KeepDir() as keep_dir:
@@ -227,7 +468,8 @@ def download_video(url: str, folder: str = 'backgrounds'):
 def random_background(folder_path: str = "backgrounds"):
     with KeepDir() as keep_dir:
         keep_dir.chdir(f"{HOME}{os.sep}{folder_path}")
-        files = os.listdir(".")
+        # Skip the hidden segment indexes stored next to the backgrounds
+        files = [file for file in os.listdir(".") if not file.startswith('.')]
         random_file = random.choice(files)
     return random_file
 
@@ -235,7 +477,7 @@ def random_background(folder_path: str = "backgrounds"):
 def get_info(filename: str, verbose: bool = False):
     try:
         with KeepDir() as keep_dir:
-            keep_dir.chdir("backgrounds")
+            keep_dir.chdir(BACKGROUNDS_DIR)
             probe = ffmpeg.probe(filename)
             video_stream = next(
                 (stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
@@ -267,28 +509,34 @@ def get_info(filename: str, verbose: bool = False):
         sys.exit(1)
 
 
-def prepare_background(background_mp4, filename_mp3, filename_srt, duration: int, verbose: bool = False):
+def video_filename(filename_srt: str) -> str:
+    video_name = filename_srt.split('/')[-1].replace(".srt", "")
+    return f"{HOME}{os.sep}output{os.sep}{video_name}.mp4"
+
+
+def prepare_background(background_mp4, filename_mp3, filename_srt, duration: int, verbose: bool = False, encoder: list = ENCODER_PROFILE, upload=None):
     # Get length of MP3 file to be merged with
     audio_info = get_info(filename_mp3)
 
-    # Get starting time:
-    audio_duration = int(round(audio_info.get('duration'), 0))
-    # print(duration-audio_duration)
-    ss = random.randint(0, (duration-audio_duration))
+    with KeepDir() as keep_dir:
+        keep_dir.chdir(BACKGROUNDS_DIR)
+        mp4_absolute_path = os.path.abspath(background_mp4)
+
+    # Get starting time: keyframe aligned, away from black frames and scene cuts
+    ss = pick_offset(mp4_absolute_path, duration, audio_info.get('duration'))
     audio_duration = convert_time(audio_info.get('duration'))
-    if ss < 0:
-        ss = 0
 
     srt_filename = filename_srt.split('/')[-1]
+    ass_filename = srt_filename.replace(".srt", ".ass")
     srt_path = "/".join(filename_srt.split('/')[:-1])
 
     create_directory(os.getcwd(), "output")
-    video_name = srt_filename.replace(".srt","")
-    outfile = f"{os.getcwd()}{os.sep}output{os.sep}{video_name}.mp4"
+    outfile = video_filename(filename_srt)
 
-    with KeepDir() as keep_dir:
-        keep_dir.chdir("backgrounds")
-        mp4_absolute_path = os.path.abspath(background_mp4)
+    # Fastest encoder and filters the local ffmpeg has for this profile
+    render_path = encode_path(encoder)
+    video_filters = ["crop=ih/16*9:ih", "scale=1080:1920:flags=lanczos", render_path['blur'],
+                     ass_filter(ass_filename, name=render_path['subtitles'])]
 
     if verbose:
         rich_print(
@@ -296,24 +544,18 @@ def prepare_background(background_mp4, filename_mp3, filename_srt, duration: int
         # 'Alignment=9,BorderStyle=3,Outline=5,Shadow=3,Fontsize=15,MarginL=5,MarginV=25,FontName=Lexend Bold,ShadowX=-7.1,ShadowY=7.1,ShadowColour=&HFF000000,Blur=141'Outline=5
     args = [
         "ffmpeg",
-        "-ss", str(ss),
+        *render_path['input_args'],
+        "-ss", f"{ss:.3f}",
         "-t", str(audio_duration),
         "-i", mp4_absolute_path,
         "-i", filename_mp3,
         "-map", "0:v",
         "-map", "1:a",
-        "-vf", (
-            "crop=ih/16*9:ih,scale=1080:1920:flags=lanczos,gblur=sigma=2,"
-            f"subtitles={srt_filename}:force_style='Alignment=8,BorderStyle=7,Outline=3,Shadow=5,Blur=15,Fontsize=15,MarginL=45,MarginR=55,FontName=Lexend Bold'"
-        ),
-        "-c:v", "libx264",
-        "-crf", "23",  # Adjust the CRF value as needed
-        "-c:a", "aac",
-        "-ac", "2",  # Use stereo audio
-        "-b:a", "192K",  # Adjust audio bitrate as needed
+        "-vf", ",".join(video_filter for video_filter in video_filters if video_filter) + render_path['upload'],
+        *render_path['output_args'],
         f"{outfile}",
         "-y",
-        "-threads", f"{multiprocessing.cpu_count()}"
+        "-threads", os.getenv('WORKER_THREADS', f"{multiprocessing.cpu_count()}")
     ]
 
 
@@ -321,39 +563,54 @@ def prepare_background(background_mp4, filename_mp3, filename_srt, duration: int
         rich_print('[i] FFMPEG Command:\n'+' '.join(args)+'\n', style='yellow')
         print('[i] FFMPEG Command:\n'+' '.join(args)+'\n')
 
+    # The uploader starts reading right away, it must not see the mp4 of a previous render
+    if os.path.isfile(outfile):
+        os.remove(outfile)
+
     with KeepDir() as keep_dir:
         keep_dir.chdir(srt_path)
         with subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE) as process:
-            pass
+            # Upload the parts ffmpeg has written so far while it encodes the rest
+            while upload is not None and process.poll() is None:
+                upload.pump()
+                time.sleep(PUMP_INTERVAL)
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args)
 
     return outfile
 
 
-def srt_create(model, path: str, series: str, part: int, text: str, filename: str) -> bool:
+def srt_create(model, path: str, series: str, part: int, text: str, filename: str, style: dict = HOUSE_STYLE) -> bool:
     """
-    Srt_create is a function that takes in five arguments: a model for speech-to-text conversion, a path to a directory, a series name, a part number, text content, and a filename for the audio file. The function uses the specified model to convert the audio file to text, and creates a .srt file with the transcribed text and timestamps.
+    Srt_create is a function that takes in five arguments: a model for speech-to-text conversion, a path to a directory, a series name, a part number, text content, and a filename for the audio file. The function uses the specified model to convert the audio file to text, and creates a .srt file with the transcribed text and timestamps, a .words.json file with the word timings before grouping and a karaoke .ass file with the given style embedded.
 
     Args:
-        model: A model object used for speech-to-text conversion.
+        model (str): The name of the Whisper model, served by the transcription server when one is running.
         path (str): A string representing the path to the directory where the .srt file will be created.
         series (str): A string representing the name of the series.
         part (int): An integer representing the part number of the series.
         text (str): A string representing the main content of the audio file.
         filename (str): A string representing the name of the audio file.
+        style (dict): The ASS style embedded in the .ass file. Default value is HOUSE_STYLE.
 
     Returns:
         bool: A boolean indicating whether the creation of the .srt file was successful or not.
 
     """
-    transcribe = model.transcribe(
-        filename, regroup=True, fp16=torch.cuda.is_available())
-    transcribe.split_by_gap(0.5).split_by_length(
-        38).merge_by_gap(0.15, max_words=2)
+    transcribe = transcribe_audio(model, filename, **TRANSCRIBE_OPTIONS)
+    if transcribe.vad_skipped:
+        console.log(f"{msg.OK}VAD skipped {transcribe.vad_skipped:.1%} of the audio")
+        logger.info(f'VAD skipped {transcribe.vad_skipped:.1%} of {filename}')
     series = series.replace(' ', '_')
     srtFilename = os.path.join(
         f"{path}{os.sep}{series}{os.sep}", f"{series}_{part}")
-    transcribe.to_srt_vtt(srtFilename+'.srt', word_level=True)
-    transcribe.to_ass(srtFilename+'.ass', word_level=True)
+    # The word timings are saved before grouping, so a new grouping does not need a new transcription
+    segments = segments_from_result(transcribe)
+    save_words(segments, srtFilename+'.words.json')
+    captions = regroup(segments, CAPTION_GROUPING)
+    captions.to_srt(srtFilename+'.srt', word_level=True)
+    write_ass(captions.segments(), srtFilename+'.ass', style=style)
     os.chdir(HOME)
     return srtFilename+".srt"
 
@@ -402,11 +659,10 @@ def create_directory(path: str, directory: str) -> bool:
     bool: Returns True if a new directory was created, False otherwise.
 
     """
-    current_dir = os.getcwd()
-    os.chdir(path)
-    if not os.path.isdir(directory):
-        os.mkdir(directory)
-        os.chdir(current_dir)
+    # The working directory is left as it was, later relative paths depend on it
+    target = os.path.join(path, directory)
+    if not os.path.isdir(target):
+        os.mkdir(target)
         return True
     return False
 
@@ -457,16 +713,76 @@ async def tts(final_text: str, voice: str = "en-US-ChristopherNeural", random_vo
         await communicate.save(outfile)
     return True
 
+def render_job(job: dict):
+    asyncio.run(main(job))
+
+
+def init_child():
+    # Keep every child on its share of the cores
+    torch.set_num_threads(CORES_PER_WORKER)
+    os.environ['WORKER_THREADS'] = str(CORES_PER_WORKER)
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--supervise", action='store_true',
+                        help="Fork child workers and scale them with the job queue")
+    parser.add_argument("--min-workers", default=1,
+                        help="Children kept alive when the queue is empty", type=int)
+    parser.add_argument("--max-workers", default=None,
+                        help="Upper bound on children (Default: cores / 2)", type=int)
+    parser.add_argument("--transcription-server", action='store_true',
+                        help="Run a transcription server process shared by the children")
+    cli_args = parser.parse_args()
+
+    # Probe ffmpeg once before any child forks, the result is cached on disk
+    render_path = encode_path(ENCODER_PROFILE)
+    console.log(f"{msg.OK}Encoding with {render_path['encoder']}")
+    logger.info(f"Encoding with {render_path['encoder']}")
 
     print("Waiting for video to be added to the queue...")
 
     if platform.system() == 'Windows':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
+    if cli_args.supervise:
+        MODELS_PRELOADED = True
+        models = [WORKER_MODEL] if WORKER_MODEL == "large" else [WORKER_MODEL, WORKER_MODEL + ".en"]
+        server = None
+        # A CUDA context does not survive a fork, so on a GPU the models live in the transcription
+        # server and the supervisor never touches CUDA. The NVML check does not initialize it.
+        os.environ.setdefault('PYTORCH_NVML_BASED_CUDA_CHECK', '1')
+        if not cli_args.transcription_server and torch.cuda.is_available():
+            console.log(f"{msg.WARNING}CUDA models cannot be shared with forked children, starting the transcription server")
+            logger.warning('CUDA is available, starting the transcription server instead of preloading the models')
+            cli_args.transcription_server = True
+        if cli_args.transcription_server:
+            # The server owns the models, the children send it their audio. A child never
+            # keeps a model it loaded while the server was down, the budget counts it as shared
+            os.environ['TRANSCRIBER_CACHE_FALLBACK'] = '0'
+            server = ServerProcess(models)
+            if not server.start():
+                console.log(f"{msg.WARNING}Transcription server is not up, children transcribe in-process until it is")
+        else:
+            # Load the models once on the CPU, the forked children share them
+            for model in models:
+                load_model(model)
+        supervisor = Supervisor(pick_job, render_job, has_pending_job, fail_job, model=WORKER_MODEL,
+                                min_workers=cli_args.min_workers, max_workers=cli_args.max_workers, init_child=init_child,
+                                on_tick=server.check if server is not None else None)
+        try:
+            supervisor.run(resume=recover_jobs())
+        except Exception as e:
+            console.log(f"{msg.ERROR}{e}")
+            logger.exception(e)
+        sys.exit(1)
+
     loop = asyncio.get_event_loop()
 
     try:
+        for job in recover_jobs():
+            loop.run_until_complete(main(job))
+
         while True:
             try:
                 loop.run_until_complete(main())
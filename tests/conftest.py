@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of code/ import each other by name, as when the worker is run from that folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
@@ -0,0 +1,63 @@
+import pytest
+
+from captions import Captions, regroup, whisper_result_data
+
+GROUPING = {'split_by_gap': 0.5, 'split_by_length': 38, 'merge_by_gap': 0.15, 'merge_max_words': 2}
+
+# Whisper segments of short phrases a few hundredths of a second apart, and a pause inside the third one
+SEGMENTS = [
+    [(" Hey", 0.00, 0.20)],
+    [(" you", 0.25, 0.40)],
+    [(" there", 0.45, 0.70), (" how", 1.50, 1.70), (" are", 1.75, 1.90)],
+    [(" you", 1.95, 2.10)],
+    [(" doing", 2.15, 2.40), (" today", 2.45, 2.80)],
+    [(" friend", 2.85, 3.20)],
+]
+
+# The lines of WhisperResult.split_by_gap(0.5).split_by_length(38).merge_by_gap(0.15, max_words=2), following
+# stable-ts' result.py: get_gap_indices joins gaps <= min_gap and _merge_segments, going backwards, skips a join
+# only when both the line and the already merged next one have more than max_words words
+STABLE_WHISPER_LINES = [
+    ("Hey you there", 0.00, 0.70),
+    ("how are you doing today friend", 1.50, 3.20),
+]
+
+
+def lines(captions: Captions) -> list:
+    return [(''.join(word for word, _, _ in segment).strip(), segment[0][1], segment[-1][2]) for segment in captions.segments()]
+
+
+def test_regroup_matches_stable_whisper():
+    assert lines(regroup(SEGMENTS, GROUPING)) == STABLE_WHISPER_LINES
+
+
+def test_regroup_matches_installed_stable_whisper():
+    stable_whisper = pytest.importorskip('stable_whisper')
+    result = stable_whisper.WhisperResult(whisper_result_data(SEGMENTS))
+    result.split_by_gap(GROUPING['split_by_gap']).split_by_length(GROUPING['split_by_length']).merge_by_gap(
+        GROUPING['merge_by_gap'], max_words=GROUPING['merge_max_words'])
+
+    expected = [(segment.text.strip(), segment.start, segment.end) for segment in result.segments]
+    assert expected == STABLE_WHISPER_LINES
+    assert lines(regroup(SEGMENTS, GROUPING)) == expected
+
+
+def test_merge_counts_the_already_merged_next_line():
+    captions = Captions.from_segments([
+        [(" a", 0.0, 0.1), (" b", 0.12, 0.2)], [(" c", 0.22, 0.3)], [(" d", 0.32, 0.4), (" e", 0.42, 0.5)]])
+    # Merged backwards: c takes d e, then a b and c d e are both longer than one word
+    assert lines(captions.merge_by_gap(0.15, max_words=1)) == [("a b", 0.0, 0.2), ("c d e", 0.22, 0.5)]
+
+
+def test_merge_without_max_words_joins_the_whole_chain():
+    captions = Captions.from_segments([[(" a", 0.0, 0.1)], [(" b", 0.12, 0.2)], [(" c", 0.22, 0.3)], [(" d", 1.0, 1.1)]])
+    assert lines(captions.merge_by_gap(0.15)) == [("a b c", 0.0, 0.3), ("d", 1.0, 1.1)]
+
+
+def test_split_by_length_counts_the_leading_space():
+    words = [(f" w{i:02d}", i * 0.3, i * 0.3 + 0.25) for i in range(12)]
+    captions = Captions.from_segments([words]).split_by_gap(0.5).split_by_length(12)
+    # 12 words of a space and 3 characters: 48 characters split into 4 lines of 3 words
+    assert [len(segment) for segment in captions.segments()] == [3, 3, 3, 3]
+    # Without the leading space the 3 words of a line would fit in 11 characters
+    assert Captions.from_segments([words[:3]]).split_by_length(11).segments() != [words[:3]]
@@ -0,0 +1,189 @@
+import json
+import types
+
+import pytest
+
+import encoders
+
+# Trimmed output of ffmpeg 6.1 built with VAAPI and QSV support
+ENCODERS_OUTPUT = """Encoders:
+ V..... = Video
+ A..... = Audio
+ S..... = Subtitle
+ .F.... = Frame-level multithreading
+ ..S... = Slice-level multithreading
+ ...X.. = Codec is experimental
+ ....B. = Supports draw_horiz_band
+ .....D = Supports direct rendering method 1
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 (codec h264)
+ V....D libx264rgb           libx264 H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 RGB (codec h264)
+ V....D h264_qsv             H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 (Intel Quick Sync Video acceleration) (codec h264)
+ V....D h264_vaapi           H.264/AVC (VAAPI) (codec h264)
+ V....D libx265              libx265 H.265 / HEVC (codec hevc)
+ V....D hevc_vaapi           H.265/HEVC (VAAPI) (codec hevc)
+ V.S... mpeg4                MPEG-4 part 2
+ A....D aac                  AAC (Advanced Audio Coding)
+ S..... ass                  ASS (Advanced SubStation Alpha) subtitle
+"""
+
+FILTERS_OUTPUT = """Filters:
+  T.. = Timeline support
+  .S. = Slice threading
+  ..C = Command support
+  A = Audio input/output
+  V = Video input/output
+  N = Dynamic number and/or type of input/output
+  | = Source or sink filter
+ ... abench            A->A       Benchmark part of a filtergraph.
+ T.C avgblur           V->V       Apply Average Blur filter.
+ TSC gblur             V->V       Apply Gaussian Blur filter.
+ ... ass               V->V       Render ASS subtitles onto input video using the libass library.
+ ... subtitles         V->V       Render text subtitles onto input video using the libass library.
+ ... hstack            N->V       Stack video inputs horizontally.
+ ... color             |->V       Provide an uniformly colored input.
+"""
+
+HWACCELS_OUTPUT = """Hardware acceleration methods:
+vdpau
+cuda
+vaapi
+qsv
+drm
+opencl
+
+"""
+
+HARDWARE = {
+    'encoders': ['aac', 'h264_qsv', 'h264_vaapi', 'hevc_vaapi', 'libx264', 'libx265', 'mpeg4'],
+    'filters': ['ass', 'avgblur', 'gblur', 'subtitles'],
+    'hwaccels': ['vaapi', 'qsv'],
+    'usable': ['h264_qsv', 'hevc_vaapi'],
+}
+SOFTWARE = {**HARDWARE, 'usable': []}
+MINIMAL = {'encoders': ['aac', 'mpeg4'], 'filters': ['avgblur', 'subtitles'], 'hwaccels': [], 'usable': []}
+
+X264_PROFILE = ["-c:v", "libx264", "-crf", "23", "-preset", "fast", "-c:a", "aac", "-ac", "2", "-b:a", "192K"]
+X265_PROFILE = ["-c:v", "libx265", "-preset", "5", "-b:v", "5M", "-c:a", "aac", "-ac", "1", "-b:a", "96K"]
+
+
+def test_parse_encoders_skips_the_legend():
+    assert encoders.parse_encoders(ENCODERS_OUTPUT) == {
+        'libx264', 'libx264rgb', 'h264_qsv', 'h264_vaapi', 'libx265', 'hevc_vaapi', 'mpeg4', 'aac', 'ass'}
+
+
+def test_parse_filters_skips_the_legend():
+    assert encoders.parse_filters(FILTERS_OUTPUT) == {'abench', 'avgblur', 'gblur', 'ass', 'subtitles', 'hstack', 'color'}
+
+
+def test_parse_hwaccels():
+    assert encoders.parse_hwaccels(HWACCELS_OUTPUT) == ['vdpau', 'cuda', 'vaapi', 'qsv', 'drm', 'opencl']
+
+
+def test_hardware_encoder_converts_crf_to_global_quality():
+    path = encoders.encode_path(X264_PROFILE, HARDWARE)
+    assert path['encoder'] == 'h264_qsv'
+    assert path['output_args'] == ["-c:v", "h264_qsv", "-c:a", "aac", "-ac", "2", "-b:a", "192K", "-global_quality", "23"]
+    assert path['upload'] == ',format=nv12'
+    assert path['blur'] == 'gblur=sigma=2'
+    assert path['subtitles'] == 'ass'
+
+
+def test_vaapi_encoder_converts_crf_to_qp():
+    path = encoders.encode_path(X264_PROFILE, {**HARDWARE, 'usable': ['h264_vaapi']})
+    assert path['encoder'] == 'h264_vaapi'
+    assert path['output_args'][-4:] == ['-rc_mode', 'CQP', '-qp', '23']
+    assert path['input_args'] == ['-vaapi_device', encoders.VAAPI_DEVICE]
+    assert path['upload'] == ',format=nv12,hwupload'
+
+
+def test_hardware_encoder_keeps_the_bitrate():
+    path = encoders.encode_path(X265_PROFILE, HARDWARE)
+    assert path['encoder'] == 'hevc_vaapi'
+    assert path['output_args'] == ["-c:v", "hevc_vaapi", "-b:v", "5M", "-c:a", "aac", "-ac", "1", "-b:a", "96K"]
+
+
+def test_software_only_keeps_the_profile():
+    path = encoders.encode_path(X264_PROFILE, SOFTWARE)
+    assert path['encoder'] == 'libx264'
+    assert path['output_args'] == X264_PROFILE
+    assert path['input_args'] == [] and path['upload'] == ''
+
+
+def test_minimal_build_falls_back_to_mpeg4_and_avgblur():
+    path = encoders.encode_path(X264_PROFILE, MINIMAL)
+    assert path['encoder'] == 'mpeg4'
+    assert path['output_args'] == ["-c:v", "mpeg4", "-c:a", "aac", "-ac", "2", "-b:a", "192K", "-b:v", encoders.FALLBACK_BITRATE]
+    assert path['blur'] == 'avgblur=sizeX=3'
+    assert path['subtitles'] == 'subtitles'
+
+
+def test_build_without_libass_is_refused():
+    with pytest.raises(RuntimeError):
+        encoders.encode_path(X264_PROFILE, {**MINIMAL, 'filters': ['avgblur']})
+
+
+def test_build_without_any_encoder_is_refused():
+    with pytest.raises(RuntimeError):
+        encoders.encode_path(X265_PROFILE, {**MINIMAL, 'encoders': ['aac']})
+
+
+@pytest.fixture
+def ffmpeg(monkeypatch, tmp_path):
+    """Fake ffmpeg answering the listing commands and test encodes, counting every run."""
+    calls = []
+    identity = {'path': '/usr/bin/ffmpeg', 'size': 1, 'mtime': 1.0, 'vaapi_device': True}
+
+    def run(args, **kwargs):
+        calls.append(args)
+        outputs = {'-encoders': ENCODERS_OUTPUT, '-filters': FILTERS_OUTPUT, '-hwaccels': HWACCELS_OUTPUT}
+        stdout = next((output for option, output in outputs.items() if option in args), '')
+        # h264_vaapi is listed but fails its test encode, as with a driver lacking H.264
+        returncode = 1 if 'h264_vaapi' in args else 0
+        return types.SimpleNamespace(stdout=stdout, returncode=returncode)
+
+    monkeypatch.setattr(encoders.subprocess, 'run', run)
+    monkeypatch.setattr(encoders, 'ffmpeg_identity', lambda: dict(identity))
+    monkeypatch.setattr(encoders, 'CAPABILITIES_PATH', str(tmp_path / 'capabilities.json'))
+    monkeypatch.setattr(encoders, 'CAPABILITIES', {})
+    return types.SimpleNamespace(calls=calls, identity=identity)
+
+
+def test_capabilities_are_probed_once(ffmpeg):
+    capabilities = encoders.ffmpeg_capabilities()
+    assert capabilities['usable'] == ['h264_qsv', 'hevc_vaapi']
+    probes = len(ffmpeg.calls)
+    # Three listings and a test encode per listed hardware encoder with its hwaccel
+    assert probes == 3 + 3
+
+    assert encoders.ffmpeg_capabilities() is capabilities
+    assert len(ffmpeg.calls) == probes
+
+
+def test_capabilities_are_read_from_disk(ffmpeg):
+    probed = dict(encoders.ffmpeg_capabilities())
+    encoders.CAPABILITIES.clear()
+    probes = len(ffmpeg.calls)
+
+    assert encoders.ffmpeg_capabilities() == probed
+    assert len(ffmpeg.calls) == probes
+
+
+def test_capabilities_are_probed_again_when_ffmpeg_changes(ffmpeg):
+    encoders.ffmpeg_capabilities()
+    encoders.CAPABILITIES.clear()
+    probes = len(ffmpeg.calls)
+
+    ffmpeg.identity['size'] = 2
+    encoders.ffmpeg_capabilities()
+    assert len(ffmpeg.calls) == 2 * probes
+    with open(encoders.CAPABILITIES_PATH, encoding='utf-8') as file:
+        assert json.load(file)['ffmpeg']['size'] == 2
+
+
+def test_refresh_probes_again(ffmpeg):
+    encoders.ffmpeg_capabilities()
+    probes = len(ffmpeg.calls)
+
+    encoders.ffmpeg_capabilities(refresh=True)
+    assert len(ffmpeg.calls) == 2 * probes
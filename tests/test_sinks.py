@@ -0,0 +1,123 @@
+import base64
+import sys
+import hashlib
+import types
+
+import pytest
+
+import sinks
+
+PART_SIZE = 1024
+
+
+class StubS3:
+    """In-memory S3 client that checks part MD5s and computes ETags like S3 does."""
+
+    def __init__(self):
+        self.uploads = {}
+        self.objects = {}
+        self.uploaded_files = []
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5):
+        md5 = hashlib.md5(Body)
+        assert base64.b64decode(ContentMD5) == md5.digest()
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': f'"{md5.hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = [self.uploads[UploadId][part['PartNumber']] for part in MultipartUpload['Parts']]
+        self.objects[Key] = b''.join(parts)
+        digest = hashlib.md5(b''.join(hashlib.md5(part).digest() for part in parts)).hexdigest()
+        return {'ETag': f'"{digest}-{len(parts)}"'}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        del self.uploads[UploadId]
+
+    def upload_file(self, filename, bucket, key, ExtraArgs=None):
+        with open(filename, 'rb') as file:
+            self.objects[key] = file.read()
+        self.uploaded_files.append(filename)
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.objects[Key])}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = StubS3()
+    monkeypatch.setitem(sys.modules, 'boto3', types.SimpleNamespace(client=lambda *args, **kwargs: client))
+    monkeypatch.setattr(sinks, 'PART_SIZE', PART_SIZE)
+    return client
+
+
+def append(filename, data: bytes):
+    with open(filename, 'ab') as file:
+        file.write(data)
+
+
+def test_growing_file_is_uploaded_in_parts(client, tmp_path):
+    filename = str(tmp_path / 'render.mp4')
+    sink = sinks.S3Sink(bucket='renders', prefix='out/', public_url='https://cdn.example', retention='keep')
+    data = bytes(range(256)) * 15  # 3840 bytes, 3 full parts and a short one
+
+    upload = sink.open(filename)
+    upload.pump()
+    assert upload.parts == []
+
+    append(filename, data[:1500])
+    upload.pump()
+    assert [len(part) for part in client.uploads[upload.upload_id].values()] == [PART_SIZE]
+
+    append(filename, data[1500:3100])
+    upload.pump()
+    assert upload.offset == 3 * PART_SIZE
+
+    append(filename, data[3100:])
+    url = upload.finish()
+
+    assert url == 'https://cdn.example/out/render.mp4'
+    sizes = [len(client.uploads[upload.upload_id][part['PartNumber']]) for part in upload.parts]
+    assert sizes == [PART_SIZE, PART_SIZE, PART_SIZE, len(data) - 3 * PART_SIZE]
+    assert client.objects['out/render.mp4'] == data
+    assert client.uploaded_files == []
+
+
+def test_composite_etag_mismatch_raises(client, tmp_path, monkeypatch):
+    filename = str(tmp_path / 'render.mp4')
+    append(filename, b'x' * 2000)
+    upload = sinks.S3Sink(bucket='renders', prefix='', retention='keep').open(filename)
+    monkeypatch.setattr(client, 'complete_multipart_upload', lambda **kwargs: {'ETag': '"0123-2"'})
+
+    with pytest.raises(sinks.ChecksumError):
+        upload.finish()
+
+
+def test_retention_delete_removes_the_local_copy(client, tmp_path):
+    filename = str(tmp_path / 'render.mp4')
+    append(filename, b'y' * 2500)
+    upload = sinks.S3Sink(bucket='renders', prefix='', retention='delete').open(filename)
+    upload.finish()
+
+    assert client.objects['render.mp4'] == b'y' * 2500
+    assert not (tmp_path / 'render.mp4').exists()
+
+
+def test_file_rewritten_during_upload_is_uploaded_again(client, tmp_path):
+    filename = str(tmp_path / 'render.mp4')
+    append(filename, b'a' * 2500)
+    upload = sinks.S3Sink(bucket='renders', prefix='', retention='keep').open(filename)
+    upload.pump()
+    assert len(upload.parts) == 2
+
+    # The muxer went back and patched bytes that were already uploaded
+    with open(filename, 'r+b') as file:
+        file.write(b'b' * 100)
+    upload.finish()
+
+    assert client.uploaded_files == [filename]
+    assert client.objects['render.mp4'] == b'b' * 100 + b'a' * 2400
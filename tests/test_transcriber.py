@@ -0,0 +1,29 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('stable_whisper')
+pytest.importorskip('requests')
+
+from whisper.model import Linear
+
+import transcriber
+
+
+class Block(torch.nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.query = Linear(8, 8)
+        self.out = torch.nn.Sequential(Linear(8, 4, bias=False), torch.nn.ReLU())
+
+
+def test_int8_quantizes_whisper_linears():
+    model = torch.nn.Sequential(Block(), torch.nn.Linear(4, 2))
+    expected = model(torch.ones(1, 8))
+
+    quantized = transcriber.quantize_int8(model)
+
+    dynamic = [module for module in quantized.modules() if isinstance(module, torch.ao.nn.quantized.dynamic.Linear)]
+    assert len(dynamic) == 3
+    assert not any(isinstance(module, Linear) for module in quantized.modules())
+    assert torch.allclose(quantized(torch.ones(1, 8)), expected, atol=0.1)